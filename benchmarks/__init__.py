@@ -0,0 +1,9 @@
+"""
+Benchmarks for the API.
+
+Most of them run against servers started separately, e.g.
+``gunicorn core.wsgi`` and ``uvicorn core.asgi:application``,
+and only use the standard library on the client side.
+json_rendering and compression run in process against the
+configured database.
+"""
@@ -0,0 +1,61 @@
+"""
+Compares the sync endpoints served over WSGI with their async
+versions served over ASGI, under the same concurrent load.
+
+Start both servers against the same database first, e.g.:
+
+    gunicorn core.wsgi --workers 1 --threads 8 --bind 127.0.0.1:8000
+    uvicorn core.asgi:application --workers 1 --port 8001
+
+then run:
+
+    python -m benchmarks.asgi_vs_wsgi --token <access_token>
+"""
+import argparse
+
+from .loadgen import dump, run_load
+
+ENDPOINTS = [
+    # (name, WSGI path, ASGI path, needs authentication)
+    ("product-list", "/api/products/?page=2", "/api/async/products/?page=2", False),
+    ("product-detail", "/api/products/1/", "/api/async/products/1/", False),
+    (
+        "order-history",
+        "/api/customers/order-history/",
+        "/api/async/customers/order-history/",
+        True,
+    ),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--wsgi-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--asgi-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--token", help="Access token for the order history.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    results = []
+    for name, wsgi_path, asgi_path, needs_token in ENDPOINTS:
+        if needs_token and not args.token:
+            continue
+        headers = {"Authorization": f"Bearer {args.token}"} if needs_token else {}
+        for server, url in (
+            ("wsgi", args.wsgi_url + wsgi_path),
+            ("asgi", args.asgi_url + asgi_path),
+        ):
+            result = run_load(
+                url,
+                requests=args.requests,
+                concurrency=args.concurrency,
+                headers=headers,
+            )
+            results.append({"endpoint": name, "server": server, **result})
+    dump(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Measures the size and CPU cost of every response compression level.
+
+Runs in process, against the database of the settings, on the product
+pages, order histories and order history exports served by the API.
+Seed it first, e.g.:
+
+    python manage.py seed_benchmark --customers 100 --products 10000 --orders 10000
+
+then run:
+
+    python -m benchmarks.compression
+"""
+import argparse
+import os
+import time
+
+from .json_rendering import best_time, payloads
+from .loadgen import dump
+
+LEVELS = {
+    "gzip": (1, 4, 6, 9),
+    "br": (1, 3, 4, 5, 6, 9, 11),
+    "zstd": (1, 3, 6, 9, 12, 19),
+}
+
+
+def export_chunks(chunk_size):
+    """
+    Returns the NDJSON chunks of the largest order history export.
+    """
+    from customers.exports import iter_chunks, ndjson_rows
+    from django.contrib.auth import get_user_model
+    from django.db.models import Count, Prefetch
+    from products.models import Order, OrderLine
+    from products.serializers import CustomerOrderHistorySerializer
+
+    customer = (
+        get_user_model()
+        .objects.annotate(orders=Count("customer_orders"))
+        .order_by("-orders")
+        .first()
+    )
+    chunks = iter_chunks(
+        Order.objects.filter(customer=customer).select_related("customer"),
+        chunk_size,
+        Prefetch("lines", OrderLine.objects.select_related("product")),
+    )
+    # Encoded as StreamingHttpResponse encodes them
+    return [
+        chunk.encode() for chunk in ndjson_rows(chunks, CustomerOrderHistorySerializer)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--number", type=int, default=50)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+    import django
+
+    django.setup()
+    from django.conf import settings
+
+    from core.compression import CODECS
+    from core.renderers import ORJSONRenderer
+
+    bodies = {
+        name: ORJSONRenderer().render(data)
+        for name, data in payloads(args.page_size).items()
+    }
+    chunks = export_chunks(settings.ORDER_EXPORT_CHUNK_SIZE)
+
+    results = []
+    for name, body in bodies.items():
+        for coding, codec in CODECS.items():
+            for level in LEVELS[coding]:
+                size = len(codec.compress(body, level))
+                micros = best_time(lambda: codec.compress(body, level), args.number)
+                results.append(
+                    {
+                        "payload": name,
+                        "coding": coding,
+                        "level": level,
+                        "bytes": len(body),
+                        "compressed_bytes": size,
+                        "ratio": round(len(body) / size, 2),
+                        "compress_us": micros,
+                        "mb_per_second": round(len(body) / micros, 1),
+                    }
+                )
+
+    # The export is compressed as the middleware streams it
+    size = sum(map(len, chunks))
+    for coding, codec in CODECS.items():
+        for level in LEVELS[coding]:
+            started = time.perf_counter()
+            compressed = sum(map(len, codec.compress_chunks(iter(chunks), level)))
+            micros = (time.perf_counter() - started) * 1e6
+            results.append(
+                {
+                    "payload": f"order history export ({len(chunks)} chunks)",
+                    "coding": coding,
+                    "level": level,
+                    "bytes": size,
+                    "compressed_bytes": compressed,
+                    "ratio": round(size / compressed, 2),
+                    "compress_us": round(micros, 1),
+                    "mb_per_second": round(size / micros, 1),
+                }
+            )
+    dump(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
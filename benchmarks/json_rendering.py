@@ -0,0 +1,124 @@
+"""
+Compares DRF's JSON renderer and parser with the orjson based ones.
+
+Runs in process, against the database of the settings, on the product
+pages and order histories served by the API. Seed it first, e.g.:
+
+    python manage.py seed_benchmark --customers 100 --products 10000 --orders 10000
+
+then run:
+
+    python -m benchmarks.json_rendering
+"""
+import argparse
+import io
+import os
+import timeit
+
+from .loadgen import dump
+
+
+def best_time(func, number):
+    """
+    Returns the best time of one call to func, in microseconds.
+    """
+    return round(min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6, 1)
+
+
+def payloads(page_size):
+    """
+    Returns the data of a product page, an order page
+    and an order history page, as the views pass them to the renderer.
+    """
+    from django.contrib.auth import get_user_model
+    from django.db.models import Count, Prefetch
+    from products.models import Order, OrderLine, Product
+    from products.serializers import (
+        CustomerOrderHistorySerializer,
+        OrderReadSerializer,
+        ProductReadSerializer,
+    )
+
+    # The links of a page number page
+    page = {"count": 1000, "next": "http://testserver/?page=3", "previous": None}
+    customer = (
+        get_user_model()
+        .objects.annotate(orders=Count("customer_orders"))
+        .order_by("-orders")
+        .first()
+    )
+    products = Product.objects.order_by("id").values(*ProductReadSerializer.row_fields)
+    orders = Order.objects.filter(customer=customer)
+    history = orders.select_related("customer").prefetch_related(
+        Prefetch("lines", OrderLine.objects.select_related("product"))
+    )
+    return {
+        "product page": {
+            **page,
+            "results": ProductReadSerializer(products[:page_size], many=True).data,
+        },
+        "order page": {
+            **page,
+            "results": OrderReadSerializer(
+                orders.values(*OrderReadSerializer.row_fields)[:page_size], many=True
+            ).data,
+        },
+        "order history page": {
+            **page,
+            "results": CustomerOrderHistorySerializer(
+                history[:page_size], many=True
+            ).data,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+    import django
+
+    django.setup()
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+
+    from core.parsers import ORJSONParser
+    from core.renderers import ORJSONRenderer
+
+    results = []
+    for name, data in payloads(args.page_size).items():
+        body = JSONRenderer().render(data)
+        render = {
+            renderer.__class__.__name__: best_time(
+                lambda: renderer.render(data), args.number
+            )
+            for renderer in (JSONRenderer(), ORJSONRenderer())
+        }
+        parse = {
+            parser.__class__.__name__: best_time(
+                lambda: parser.parse(io.BytesIO(body)), args.number
+            )
+            for parser in (JSONParser(), ORJSONParser())
+        }
+        results.append(
+            {
+                "payload": name,
+                "bytes": len(body),
+                "identical": ORJSONRenderer().render(data) == body,
+                "render_us": render,
+                "render_speedup": round(
+                    render["JSONRenderer"] / render["ORJSONRenderer"], 1
+                ),
+                "parse_us": parse,
+                "parse_speedup": round(parse["JSONParser"] / parse["ORJSONParser"], 1),
+            }
+        )
+    dump(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Load tests the catalog, order creation and order history endpoints.
+
+Seed the database and start the server first, e.g.:
+
+    python manage.py seed_benchmark
+    gunicorn core.wsgi --workers 4 --threads 8 --bind 127.0.0.1:8000
+
+then run, logging in as one of the seeded customers:
+
+    python -m benchmarks.load_test --username bench1 --output baseline.json
+
+and after a change, compare against it:
+
+    python -m benchmarks.load_test --username bench1 --baseline baseline.json
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+from urllib.request import Request, urlopen
+
+from .loadgen import dump, run_load
+
+SCENARIOS = (
+    "catalog",
+    "catalog-middle-page",
+    "catalog-search",
+    "product-detail",
+    "order-create",
+    "order-history",
+)
+
+
+def fetch(url, data=None, token=None):
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    body = json.dumps(data).encode() if data is not None else None
+    with urlopen(Request(url, data=body, headers=headers)) as response:
+        return json.load(response)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_scenarios(args, token, product_ids, product_count):
+    """
+    Returns the keyword arguments of run_load() for every scenario.
+    """
+    rng = random.Random(args.seed)
+    authenticated = {"Authorization": f"Bearer {token}"}
+
+    def order_body():
+        products = rng.sample(product_ids, rng.randint(1, min(3, len(product_ids))))
+        return json.dumps(
+            {
+                "customer": {"username": args.username},
+                "products": [{"id": id, "quantity": 1} for id in products],
+            }
+        )
+
+    return {
+        "catalog": {"url": f"{args.url}/api/products/"},
+        # Page numbers use OFFSET, so a page in the middle shows its cost
+        "catalog-middle-page": {
+            "url": f"{args.url}/api/products/?page={max(1, product_count // 20)}"
+        },
+        "catalog-search": {"url": f"{args.url}/api/products/?search=leather+chair"},
+        "product-detail": {
+            "url": args.url,
+            "path": lambda: f"/api/products/{rng.choice(product_ids)}/",
+        },
+        "order-create": {
+            "url": f"{args.url}/api/products/orders/",
+            "method": "POST",
+            "headers": {**authenticated, "Content-Type": "application/json"},
+            "body": order_body,
+        },
+        "order-history": {
+            "url": f"{args.url}/api/customers/order-history/",
+            "headers": authenticated,
+        },
+    }
+
+
+def compare(baseline, results):
+    """
+    Prints the change of throughput and latency of every scenario
+    from the baseline, in percent. Negative latency changes are faster.
+    """
+    print(f"{'scenario':<22}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, result in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            print(f"{name:<22}{'new':>10}")
+            continue
+
+        def change(old, new):
+            return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+        print(
+            f"{name:<22}"
+            f"{change(before['requests_per_second'], result['requests_per_second']):>10}"
+            + "".join(
+                f"{change(before['latency_ms'][key], result['latency_ms'][key]):>10}"
+                for key in ("p50", "p95", "p99")
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", default="benchpassword")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=100,
+        help="Requests sent to each scenario before it is measured.",
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=SCENARIOS,
+        help="Run only this scenario. Can be repeated.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare the results with this JSON file.")
+    args = parser.parse_args()
+
+    token = fetch(
+        f"{args.url}/api/customers/login/",
+        {"username": args.username, "password": args.password},
+    )["access"]
+    catalog = fetch(f"{args.url}/api/products/?page_size=100")
+    product_ids = [product["id"] for product in catalog["results"]]
+    if not product_ids:
+        parser.error("There are no products, seed the database first.")
+
+    scenarios = build_scenarios(args, token, product_ids, catalog["count"])
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "url": args.url,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "products": catalog["count"],
+        },
+        "scenarios": {},
+    }
+    for name in args.scenario or SCENARIOS:
+        if args.warmup:
+            run_load(
+                **scenarios[name], requests=args.warmup, concurrency=args.concurrency
+            )
+        started = time.perf_counter()
+        results["scenarios"][name] = run_load(
+            **scenarios[name], requests=args.requests, concurrency=args.concurrency
+        )
+        print(f"{name}: {time.perf_counter() - started:.1f}s")
+
+    dump(results, args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
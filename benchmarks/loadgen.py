@@ -0,0 +1,114 @@
+import http.client
+import json
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(latencies, percent):
+    """
+    Returns the given percentile of a sorted list of latencies.
+    """
+    if not latencies:
+        return 0.0
+    index = min(len(latencies) - 1, int(round(percent / 100 * (len(latencies) - 1))))
+    return latencies[index]
+
+
+def run_load(
+    url,
+    requests=1000,
+    concurrency=50,
+    headers=None,
+    method="GET",
+    body=None,
+    path=None,
+):
+    """
+    Sends `requests` requests to `url` from `concurrency` threads,
+    each holding one keep-alive connection, and returns a summary
+    with the throughput and the p50/p95/p99 latencies in milliseconds.
+
+    `body` may be a callable returning the body of each request,
+    so that every request can post different data. Likewise `path`
+    may be a callable returning the path and query of each request,
+    e.g. to fetch different objects, in which case `url` gives the host.
+    """
+    parts = urlsplit(url)
+    if path is None:
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+    headers = dict(headers or {})
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def take():
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def worker():
+        connection = http.client.HTTPConnection(parts.hostname, parts.port or 80)
+        own_latencies = []
+        own_statuses = {}
+        while take():
+            payload = body() if callable(body) else body
+            target = path() if callable(path) else path
+            started = time.perf_counter()
+            try:
+                connection.request(method, target, body=payload, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                code = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(
+                    parts.hostname, parts.port or 80
+                )
+                code = "error"
+            own_latencies.append((time.perf_counter() - started) * 1000)
+            own_statuses[code] = own_statuses.get(code, 0) + 1
+        connection.close()
+        with lock:
+            latencies.extend(own_latencies)
+            for code, count in own_statuses.items():
+                statuses[code] = statuses.get(code, 0) + count
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "url": url,
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "statuses": {str(code): count for code, count in statuses.items()},
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies), 2) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+        },
+    }
+
+
+def dump(results, path=None):
+    """
+    Prints the results as JSON, and writes them to `path` if given.
+    """
+    output = json.dumps(results, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(output + "\n")
+    print(output)
@@ -0,0 +1,75 @@
+"""
+Measures the catalog latency on its own and during a storm of logins.
+
+Start the ASGI server, and create a user to log in with, e.g.:
+
+    uvicorn core.asgi:application --workers 1 --port 8001
+
+then run:
+
+    python -m benchmarks.login_storm --username <username> --password <password>
+
+Use --login-path /api/customers/login/ to storm the sync login instead.
+"""
+import argparse
+import json
+import threading
+
+from .loadgen import dump, run_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://127.0.0.1:8001")
+    parser.add_argument("--catalog-path", default="/api/async/products/?page=2")
+    parser.add_argument("--login-path", default="/api/async/customers/login/")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--logins", type=int, default=400)
+    parser.add_argument("--login-concurrency", type=int, default=50)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    catalog_url = args.url + args.catalog_path
+    results = [
+        {
+            "phase": "catalog alone",
+            **run_load(
+                catalog_url, requests=args.requests, concurrency=args.concurrency
+            ),
+        }
+    ]
+
+    storm = {}
+
+    def login_storm():
+        storm.update(
+            run_load(
+                args.url + args.login_path,
+                requests=args.logins,
+                concurrency=args.login_concurrency,
+                headers={"Content-Type": "application/json"},
+                method="POST",
+                body=json.dumps({"username": args.username, "password": args.password}),
+            )
+        )
+
+    thread = threading.Thread(target=login_storm)
+    thread.start()
+    results.append(
+        {
+            "phase": "catalog during logins",
+            **run_load(
+                catalog_url, requests=args.requests, concurrency=args.concurrency
+            ),
+        }
+    )
+    thread.join()
+    results.append({"phase": "logins", **storm})
+    dump(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
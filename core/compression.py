@@ -0,0 +1,113 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+class GzipCodec:
+    name = "gzip"
+
+    def compress(self, data, level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    def compress_chunks(self, chunks, level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            # Flushed, so that every chunk reaches the client as it is made
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class BrotliCodec:
+    name = "br"
+
+    def compress(self, data, level):
+        return brotli.compress(data, quality=level)
+
+    def compress_chunks(self, chunks, level):
+        compressor = brotli.Compressor(quality=level)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+
+
+class ZstandardCodec:
+    name = "zstd"
+
+    def compress(self, data, level):
+        return zstandard.ZstdCompressor(level=level).compress(data)
+
+    def compress_chunks(self, chunks, level):
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(
+                zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            )
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+# The codecs whose library is installed, by content coding
+CODECS = {
+    codec.name: codec
+    for codec, library in (
+        (BrotliCodec(), brotli),
+        (ZstandardCodec(), zstandard),
+        (GzipCodec(), zlib),
+    )
+    if library is not None
+}
+
+
+def parse_accept_encoding(header):
+    """
+    Returns the content codings of an Accept-Encoding header
+    mapped to their quality, e.g. {"gzip": 1.0, "br": 0.5}.
+    """
+    qualities = {}
+    for item in header.split(","):
+        coding, *params = item.strip().lower().split(";")
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip()] = quality
+    return qualities
+
+
+def negotiate(header, preferred):
+    """
+    Returns the name of the codec to compress a response with,
+    or None if it should not be compressed.
+
+    The client's highest quality coding wins, ties going to the
+    first one in `preferred`. Only installed codecs are considered.
+    """
+    qualities = parse_accept_encoding(header or "")
+    best, best_quality = None, 0.0
+    for name in preferred:
+        if name not in CODECS:
+            continue
+        quality = qualities.get(name, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
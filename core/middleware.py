@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+import random
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from .compression import CODECS, negotiate
+from .profiling import (
+    Profile,
+    current_profile,
+    install_query_profiling,
+    instrument_rest_framework,
+)
+
+logger = logging.getLogger("core.profiling")
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a sample of the requests.
+
+    For each sampled request, the total time, the time spent in the
+    database and the number of queries, and the time spent serializing
+    and rendering are sent back in a Server-Timing header and logged
+    as one JSON line on the core.profiling logger.
+
+    PROFILING_SAMPLE_RATE is the share of requests profiled, from 0 to 1.
+    Requests that are not sampled only pay for a random() call.
+    DRF and the database connections are only instrumented when the
+    rate is above 0 as the middleware is loaded, so with the default
+    of 0 nothing is patched.
+    Serializing includes the queries of lazily evaluated querysets,
+    and the total does not include streaming a response body.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the middleware as async, as Django's MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+        if settings.PROFILING_SAMPLE_RATE > 0:
+            instrument_rest_framework()
+            connection_created.connect(install_query_profiling)
+            for connection in connections.all():
+                install_query_profiling(None, connection)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+        profile = Profile()
+        token = current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.report(request, response, profile)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        profile = Profile()
+        token = current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.report(request, response, profile)
+
+    def sampled(self):
+        rate = settings.PROFILING_SAMPLE_RATE
+        return rate > 0 and (rate >= 1 or random.random() < rate)
+
+    def report(self, request, response, profile):
+        total = profile.total
+        timings = {
+            "total": total,
+            "db": profile.timings["db"],
+            "serialize": profile.timings["serialize"],
+            "render": profile.timings["render"],
+        }
+        if settings.PROFILING_SERVER_TIMING:
+            response.headers["Server-Timing"] = ", ".join(
+                f"{name};dur={seconds * 1000:.2f}"
+                + (f';desc="{profile.queries} queries"' if name == "db" else "")
+                for name, seconds in timings.items()
+            )
+
+        line = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "queries": profile.queries,
+            **{
+                f"{name}_ms": round(seconds * 1000, 2)
+                for name, seconds in timings.items()
+            },
+        }
+        logger.info(json.dumps(line), extra={"profile": line})
+        return response
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses with the best coding the client accepts
+    among COMPRESSION_ENCODINGS, e.g. Brotli, Zstandard and gzip.
+
+    Brotli and Zstandard are used when the brotli and zstandard
+    packages are installed. Only the COMPRESSION_CONTENT_TYPES are
+    compressed, at the level set for their coding in
+    COMPRESSION_LEVELS, and responses under COMPRESSION_MIN_SIZE
+    bytes are left alone. Streaming responses are compressed chunk
+    by chunk, each chunk being flushed to the client as it is made.
+    """
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < (
+            settings.COMPRESSION_MIN_SIZE
+        ):
+            return response
+        if response.has_header("Content-Encoding"):
+            return response
+        if not response.get("Content-Type", "").startswith(
+            settings.COMPRESSION_CONTENT_TYPES
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        coding = negotiate(
+            request.META.get("HTTP_ACCEPT_ENCODING"), settings.COMPRESSION_ENCODINGS
+        )
+        if coding is None:
+            return response
+        codec = CODECS[coding]
+        level = settings.COMPRESSION_LEVELS[coding]
+
+        if response.streaming:
+            response.streaming_content = codec.compress_chunks(
+                response.streaming_content, level
+            )
+            del response.headers["Content-Length"]
+        else:
+            compressed = codec.compress(response.content, level)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(compressed))
+
+        # Weak, as GZipMiddleware makes it, since the bytes changed
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = coding
+        return response
@@ -0,0 +1,138 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalListMixin:
+    """
+    Answers conditional GET requests on list actions.
+
+    The ETag and Last-Modified validators are derived from one
+    aggregate query over BaseModel.updated_at (and any related
+    `updated_at` listed in `conditional_fields`) plus the row count.
+    When the client already holds the current representation,
+    a 304 is returned without serializing anything.
+
+    Lists only get an ETag. Their latest updated_at, in whole seconds,
+    misses a second change within the same second and rows deleted
+    from the list, so If-Modified-Since alone could get a stale 304.
+    """
+
+    conditional_fields = ("updated_at",)
+
+    def get_validators(self, queryset):
+        """
+        Returns the (etag, last_modified) pair of the queryset,
+        or None when it is empty.
+        """
+        aggregates = {
+            f"last_{i}": Max(field) for i, field in enumerate(self.conditional_fields)
+        }
+        state = queryset.order_by().aggregate(
+            count=Count("id", distinct=True), **aggregates
+        )
+        timestamps = [state[key] for key in aggregates if state[key] is not None]
+        if not state["count"] or not timestamps:
+            return None
+
+        seed = ":".join([str(state["count"])] + [str(state[key]) for key in aggregates])
+        etag = quote_etag(hashlib.md5(seed.encode()).hexdigest())
+        return etag, int(max(timestamps).timestamp())
+
+    def get_list_validators(self, queryset):
+        """
+        Returns the validators of a list, without its last modification time.
+        """
+        validators = self.get_validators(queryset)
+        if validators is None:
+            return None
+        return validators[0], None
+
+    def get_object_validators(self):
+        """
+        Returns the validators of the object looked up by the view.
+        Lookup values that cannot match are left for get_object() to 404.
+        """
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            queryset = queryset.filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
+            return self.get_validators(queryset)
+        except (TypeError, ValueError, ValidationError):
+            return None
+
+    def get_not_modified_response(self, request, validators):
+        """
+        Returns a 304 response if the client's copy is still current.
+        """
+        if validators is None:
+            return None
+        etag, last_modified = validators
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is not None:
+            return self.set_validators(response, validators)
+        return None
+
+    def set_validators(self, response, validators):
+        if validators is not None and response.status_code in (200, 304):
+            etag, last_modified = validators
+            response.headers.setdefault("ETag", etag)
+            if last_modified is not None:
+                response.headers.setdefault("Last-Modified", http_date(last_modified))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        validators = self.get_list_validators(self.filter_queryset(self.get_queryset()))
+        not_modified = self.get_not_modified_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+        response = super().list(request, *args, **kwargs)
+        return self.set_validators(response, validators)
+
+
+class ConditionalGetMixin(ConditionalListMixin):
+    """
+    Answers conditional GET requests on list and retrieve actions.
+
+    Viewsets without a retrieve action use ConditionalListMixin,
+    so that the router does not route to a missing action.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        validators = self.get_object_validators()
+        not_modified = self.get_not_modified_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+        response = super().retrieve(request, *args, **kwargs)
+        return self.set_validators(response, validators)
+
+
+class ReadSerializerMixin:
+    """
+    Serves the list and retrieve actions with `read_serializer_class`.
+
+    Those actions read `values(*read_serializer_class.row_fields)`
+    rows instead of model instances, which the read serializer turns
+    into the same JSON as `serializer_class` at a fraction of the cost.
+    """
+
+    read_serializer_class = None
+    read_actions = ("list", "retrieve")
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in self.read_actions:
+            return queryset.values(*self.read_serializer_class.row_fields)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action in self.read_actions:
+            return self.read_serializer_class
+        return super().get_serializer_class()
@@ -1,15 +1,32 @@
 from django.db import models
 
 
+class SoftDeleteManager(models.Manager):
+    """
+    Manager leaving out the rows marked as deleted.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(is_deleted=False)
+
+
 class BaseModel(models.Model):
     """
     Base Model for fields common to most models.
+
+    `objects` only returns the rows that are not marked as deleted,
+    `all_objects` returns every row. The latter is the default manager,
+    so related objects, the admin and uniqueness checks still see
+    deleted rows.
     """
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_deleted = models.BooleanField(default=False)
 
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
+
     @property
     def delete(self):
         """
@@ -22,3 +39,4 @@ class BaseModel(models.Model):
     class Meta:
         abstract = True
         ordering = ["-id"]
+        default_manager_name = "all_objects"
@@ -1,7 +1,80 @@
 from rest_framework import pagination
 
 
+class CustomCursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination over a unique, unchanging key.
+
+    Each page is a range scan starting after the last row
+    of the previous one, so there is no COUNT(*) and no OFFSET,
+    and deep pages cost the same as the first page.
+
+    Views set `cursor_ordering` to the key they are paginated on,
+    e.g. "id" or "-id".
+    """
+
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = "-id"
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, "cursor_ordering", self.ordering)
+        if isinstance(ordering, str):
+            return (ordering,)
+        return tuple(ordering)
+
+
 class CustomPagination(pagination.PageNumberPagination):
+    """
+    Page number pagination by default.
+
+    Clients can opt in to keyset pagination with `?pagination=cursor`.
+    The links of a cursor page carry a `cursor` parameter,
+    which keeps the following pages in cursor mode.
+    """
+
     page_size = 10
     page_size_query_param = "page_size"
     max_page_size = 100
+    mode_query_param = "pagination"
+    cursor_paginator = None
+
+    def use_cursor(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == "cursor"
+            or CustomCursorPagination.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.cursor_paginator = CustomCursorPagination()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append(
+            {
+                "name": self.mode_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Set to 'cursor' to use keyset pagination.",
+                "schema": {"type": "string", "enum": ["page", "cursor"]},
+            }
+        )
+        parameters.append(
+            {
+                "name": CustomCursorPagination.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": CustomCursorPagination.cursor_query_description,
+                "schema": {"type": "string"},
+            }
+        )
+        return parameters
@@ -0,0 +1,90 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+
+# The profile of the request being handled, None when it is not sampled.
+# Context variables follow the request into sync_to_async() threads.
+current_profile = ContextVar("current_profile", default=None)
+
+
+class Profile:
+    """
+    Timings, in seconds, and query count of one request.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = defaultdict(float)
+        self.queries = 0
+
+    @contextmanager
+    def timed(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - started
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+
+@contextmanager
+def timed(name):
+    """
+    Adds the time spent in the block to the current profile, if any.
+    """
+    profile = current_profile.get()
+    if profile is None:
+        yield
+    else:
+        with profile.timed(name):
+            yield
+
+
+def profile_queries(execute, sql, params, many, context):
+    """
+    Database execute wrapper counting and timing the queries
+    of the current profile.
+    """
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    profile.queries += 1
+    with profile.timed("db"):
+        return execute(sql, params, many, context)
+
+
+def install_query_profiling(sender, connection, **kwargs):
+    """
+    connection_created receiver adding profile_queries to every connection.
+    """
+    if profile_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_queries)
+
+
+def _timed_property(prop, name):
+    def fget(self):
+        with timed(name):
+            return prop.fget(self)
+
+    fget._profiled = True
+    return property(fget, prop.fset, prop.fdel, prop.__doc__)
+
+
+def instrument_rest_framework():
+    """
+    Times serializer.data and response rendering of DRF.
+
+    Every serializer and response goes through these two properties,
+    so timing them covers all views without touching any of them.
+    """
+    if not getattr(BaseSerializer.data.fget, "_profiled", False):
+        BaseSerializer.data = _timed_property(BaseSerializer.data, "serialize")
+    if not getattr(Response.rendered_content.fget, "_profiled", False):
+        Response.rendered_content = _timed_property(Response.rendered_content, "render")
@@ -0,0 +1,131 @@
+import re
+from collections import Counter
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.backends.utils import CursorWrapper
+from django.test.runner import DiscoverRunner
+from django.urls import URLPattern, URLResolver, get_resolver
+
+NUMBER = re.compile(r"\b\d+(\.\d+)?\b")
+STRING = re.compile(r"'(?:[^']|'')*'")
+VALUES = re.compile(r"\((\s*\?\s*,)*\s*\?\s*\)")
+
+
+def query_shape(sql):
+    """
+    Returns the SQL of a query with its literals replaced by ?,
+    so that queries only differing in their parameters compare equal.
+    """
+    shape = STRING.sub("?", sql)
+    shape = NUMBER.sub("?", shape)
+    return VALUES.sub("(...)", shape)
+
+
+def iter_route_names(patterns=None, namespace=None):
+    """
+    Yields the namespaced name of every named route, e.g. "products:orders-list".
+    """
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            nested = namespace
+            if pattern.namespace:
+                nested = (
+                    f"{namespace}:{pattern.namespace}"
+                    if namespace
+                    else pattern.namespace
+                )
+            yield from iter_route_names(pattern.url_patterns, nested)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield f"{namespace}:{pattern.name}" if namespace else pattern.name
+
+
+def capture_queries(request):
+    """
+    Calls request(), consuming streamed responses, with an empty cache.
+    Returns the response and the SQL of the queries it ran.
+
+    Queries are captured on every connection of every thread, so the
+    ones async views run in sync_to_async() threads are counted too.
+    """
+    cache.clear()
+    queries = []
+    execute_with_wrappers = CursorWrapper._execute_with_wrappers
+
+    def record(cursor, sql, params, many, executor):
+        try:
+            return execute_with_wrappers(cursor, sql, params, many, executor)
+        finally:
+            if not many:
+                sql = cursor.db.ops.last_executed_query(cursor.cursor, sql, params)
+            queries.append(sql)
+
+    with mock.patch.object(CursorWrapper, "_execute_with_wrappers", record):
+        response = request()
+        if getattr(response, "streaming", False):
+            b"".join(response.streaming_content)
+    return response, queries
+
+
+class QueryBudgetMixin:
+    """
+    Test case mixin asserting that the number of queries an endpoint runs
+    does not depend on how many objects it deals with.
+    """
+
+    def assertConstantQueries(self, request, seed, sizes=(1, 10, 100), budget=None):
+        """
+        Seeds the data with seed(size) for each size and calls request(size).
+
+        Fails if the query count differs between sizes, showing the queries
+        that appeared or disappeared, or if it exceeds the budget.
+        Returns the queries of the largest size.
+        """
+        recorded = []
+        for size in sizes:
+            seed(size)
+            response, queries = capture_queries(lambda: request(size))
+            self.assertLess(
+                response.status_code,
+                400,
+                f"Request for size {size} failed with {response.status_code}",
+            )
+            recorded.append((size, queries))
+
+        (first_size, first), (last_size, last) = recorded[0], recorded[-1]
+        counts = {size: len(queries) for size, queries in recorded}
+        if len(set(counts.values())) > 1:
+            extra = Counter(map(query_shape, last)) - Counter(map(query_shape, first))
+            self.fail(
+                f"Query count changes with the data: {counts}\n"
+                f"Queries with {last_size} objects that do not run with "
+                f"{first_size}:\n"
+                + "\n".join(f"{count} x {shape}" for shape, count in extra.items())
+            )
+        if budget:
+            self.assertTrue(
+                last, "No queries were captured for a route with a query budget"
+            )
+        if budget is not None:
+            self.assertLessEqual(
+                len(last),
+                budget,
+                "Query budget exceeded:\n"
+                + "\n".join(query_shape(sql) for sql in last),
+            )
+        return last
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Test runner turning request profiling off, so that randomly sampled
+    requests neither log nor carry a Server-Timing header in the tests.
+    The profiling tests turn it on with override_settings.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.PROFILING_SAMPLE_RATE = 0
@@ -0,0 +1,604 @@
+import gzip
+import io
+import json
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+
+from customers.models import CustomerOrderStats
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from model_bakery import baker
+from products.models import Order, OrderLine, Product
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from core import compression
+from core.compression import brotli, negotiate, parse_accept_encoding, zstandard
+from core.middleware import ProfilingMiddleware
+from core.parsers import ORJSONParser
+from core.renderers import ORJSONRenderer
+from core.testing import (
+    QueryBudgetMixin,
+    capture_queries,
+    iter_route_names,
+    query_shape,
+)
+
+User = get_user_model()
+
+# Routes outside of the API
+EXCLUDED_ROUTES = ("admin:", "schema", "swagger-ui", "redoc")
+
+# Every API route and the test holding it to its query budget
+ROUTES = {
+    "customers:users-list": "test_register",
+    "customers:login": "test_login",
+    "customers:refresh": "test_refresh",
+    "customers:customers-list": "test_order_history",
+    "customers:customers-export": "test_order_history_export",
+    "customers:customers-summary": "test_order_history_summary",
+    "products:products-list": "test_product_list",
+    "products:products-detail": "test_product_detail",
+    "products:orders-list": "test_order_list",
+    "products:orders-detail": "test_order_detail",
+    "customers_async:users-list": "test_register",
+    "customers_async:login": "test_login",
+    "customers_async:customers-list": "test_order_history",
+    "products_async:products-list": "test_product_list",
+    "products_async:products-detail": "test_product_detail",
+}
+
+
+class TestQueryBudgets(QueryBudgetMixin, APITransactionTestCase):
+    """
+    Holds every API route to a query count that does not grow
+    with the number of objects it returns, at 1, 10 and 100 objects.
+
+    A transaction test case, so that the async routes running
+    their queries in other threads see the seeded data.
+    """
+
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.user.set_password("testpassword")
+        self.user.save()
+
+    def seed_products(self, size):
+        """
+        Tops the products up to size, keeping their ids in product_ids.
+        """
+        missing = size - Product.objects.count()
+        if missing > 0:
+            baker.make(Product, price=Decimal("1.00"), quantity=1000, _quantity=missing)
+        self.product_ids = list(
+            Product.objects.order_by("id").values_list("id", flat=True)
+        )
+
+    def seed_orders(self, size):
+        """
+        Tops the customer's orders up to size, each with two lines.
+        """
+        self.seed_products(2)
+        products = list(Product.objects.order_by("id")[:2])
+        missing = size - Order.objects.filter(customer=self.user).count()
+        for _ in range(max(missing, 0)):
+            order = Order.objects.create(customer=self.user, total_amount=2)
+            OrderLine.objects.bulk_create(
+                OrderLine(order=order, product=product, quantity=1, unit_price=1)
+                for product in products
+            )
+
+    def seed_order_with_lines(self, size):
+        """
+        Creates an order with size lines and returns it.
+        """
+        self.seed_products(size)
+        order = Order.objects.create(customer=self.user, total_amount=size)
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, product=product, quantity=1, unit_price=1)
+            for product in Product.objects.order_by("id")[:size]
+        )
+        return order
+
+    def test_every_route_has_a_budget(self):
+        routes = {
+            name for name in iter_route_names() if not name.startswith(EXCLUDED_ROUTES)
+        }
+        self.assertEqual(routes, set(ROUTES))
+        for test in ROUTES.values():
+            self.assertTrue(hasattr(self, test), test)
+
+    def test_product_list(self):
+        for name in ("products:products-list", "products_async:products-list"):
+            with self.subTest(name):
+                self.assertConstantQueries(
+                    lambda size: self.client.get(reverse(name), {"page_size": size}),
+                    self.seed_products,
+                    # Validators, count, products
+                    budget=3,
+                )
+
+    def test_async_queries_are_captured(self):
+        self.seed_products(3)
+        _, sync_queries = capture_queries(
+            lambda: self.client.get(reverse("products:products-list"))
+        )
+        _, async_queries = capture_queries(
+            lambda: self.client.get(reverse("products_async:products-list"))
+        )
+        self.assertTrue(sync_queries)
+        self.assertEqual(
+            list(map(query_shape, async_queries)), list(map(query_shape, sync_queries))
+        )
+
+    def test_product_detail(self):
+        for name in ("products:products-detail", "products_async:products-detail"):
+            with self.subTest(name):
+                self.assertConstantQueries(
+                    lambda size: self.client.get(
+                        reverse(name, args=[self.product_ids[size - 1]])
+                    ),
+                    self.seed_products,
+                    budget=2,
+                )
+
+    def test_order_list(self):
+        self.client.force_authenticate(self.user)
+        self.assertConstantQueries(
+            lambda size: self.client.get(
+                reverse("products:orders-list"), {"page_size": size}
+            ),
+            self.seed_orders,
+            budget=4,
+        )
+
+    def test_order_detail(self):
+        self.client.force_authenticate(self.user)
+        orders = {}
+        self.assertConstantQueries(
+            lambda size: self.client.get(
+                reverse("products:orders-detail", args=[orders[size].order_id])
+            ),
+            lambda size: orders.update({size: self.seed_order_with_lines(size)}),
+            budget=3,
+        )
+
+    def test_order_creation(self):
+        self.client.force_authenticate(self.user)
+        self.assertConstantQueries(
+            lambda size: self.client.post(
+                reverse("products:orders-list"),
+                {
+                    "customer": {"username": "testuser"},
+                    "products": [
+                        {"id": id, "quantity": 1} for id in self.product_ids[:size]
+                    ],
+                },
+                format="json",
+            ),
+            self.seed_products,
+            budget=7,
+        )
+
+    def test_order_history(self):
+        self.client.force_authenticate(self.user)
+        for name in ("customers:customers-list", "customers_async:customers-list"):
+            with self.subTest(name):
+                self.assertConstantQueries(
+                    lambda size: self.client.get(reverse(name), {"page_size": size}),
+                    self.seed_orders,
+                    budget=4,
+                )
+
+    def test_order_history_export(self):
+        self.client.force_authenticate(self.user)
+        # Up to ORDER_EXPORT_CHUNK_SIZE orders, read in one chunk
+        self.assertConstantQueries(
+            lambda size: self.client.get(reverse("customers:customers-export")),
+            self.seed_orders,
+            budget=2,
+        )
+
+    def test_order_history_summary(self):
+        self.client.force_authenticate(self.user)
+        CustomerOrderStats.objects.filter(customer=self.user).update(total_orders=1)
+        self.assertConstantQueries(
+            lambda size: self.client.get(reverse("customers:customers-summary")),
+            self.seed_orders,
+            budget=1,
+        )
+
+    def test_register(self):
+        for prefix, name in (
+            ("sync", "customers:users-list"),
+            ("async", "customers_async:users-list"),
+        ):
+            with self.subTest(name):
+                self.assertConstantQueries(
+                    lambda size: self.client.post(
+                        reverse(name),
+                        {
+                            "username": f"{prefix}{size}",
+                            "email": f"{prefix}{size}@test.com",
+                            "password": "newpassword",
+                        },
+                        format="json",
+                    ),
+                    lambda size: None,
+                    sizes=(1,),
+                    # Unique checks, user, order stats created with get_or_create()
+                    budget=6,
+                )
+
+    def test_login(self):
+        for name in ("customers:login", "customers_async:login"):
+            with self.subTest(name):
+                self.assertConstantQueries(
+                    lambda size: self.client.post(
+                        reverse(name),
+                        {"username": "testuser", "password": "testpassword"},
+                        format="json",
+                    ),
+                    lambda size: None,
+                    sizes=(1,),
+                    budget=1,
+                )
+
+    def test_refresh(self):
+        refresh = self.client.post(
+            reverse("customers:login"),
+            {"username": "testuser", "password": "testpassword"},
+        ).json()["refresh"]
+        self.assertConstantQueries(
+            lambda size: self.client.post(
+                reverse("customers:refresh"), {"refresh": refresh}
+            ),
+            lambda size: None,
+            sizes=(1,),
+            budget=0,
+        )
+
+
+class TestProfilingMiddleware(APITransactionTestCase):
+    def setUp(self):
+        baker.make(Product, _quantity=3)
+
+    def get_timings(self, response):
+        timings = {}
+        for metric in response["Server-Timing"].split(", "):
+            name, *params = metric.split(";")
+            timings[name] = dict(param.split("=", 1) for param in params)
+        return timings
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sampled_requests_are_profiled(self):
+        for name in ("products:products-list", "products_async:products-list"):
+            with self.subTest(name):
+                with self.assertLogs("core.profiling", "INFO") as logs:
+                    response = self.client.get(reverse(name))
+
+                timings = self.get_timings(response)
+                self.assertEqual(list(timings), ["total", "db", "serialize", "render"])
+                # Validators, count, products
+                self.assertEqual(timings["db"]["desc"], '"3 queries"')
+                self.assertGreater(float(timings["render"]["dur"]), 0)
+                self.assertGreaterEqual(
+                    float(timings["total"]["dur"]), float(timings["db"]["dur"])
+                )
+
+                line = json.loads(logs.records[0].getMessage())
+                self.assertEqual(line["path"], reverse(name))
+                self.assertEqual(line["status"], 200)
+                self.assertEqual(line["queries"], 3)
+                self.assertEqual(logs.records[0].profile, line)
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_requests_that_are_not_sampled(self):
+        response = self.client.get(reverse("products:products-list"))
+        self.assertNotIn("Server-Timing", response)
+
+    def test_nothing_is_instrumented_when_profiling_is_off(self):
+        self.assertEqual(settings.PROFILING_SAMPLE_RATE, 0)
+        with mock.patch(
+            "core.middleware.instrument_rest_framework"
+        ) as instrument, mock.patch(
+            "core.middleware.install_query_profiling"
+        ) as install:
+            ProfilingMiddleware(lambda request: None)
+        instrument.assert_not_called()
+        install.assert_not_called()
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_SERVER_TIMING=False)
+    def test_server_timing_can_be_turned_off(self):
+        with self.assertLogs("core.profiling", "INFO"):
+            response = self.client.get(reverse("products:products-list"))
+        self.assertNotIn("Server-Timing", response)
+
+
+@dataclass
+class Point:
+    x: int
+
+
+class TestORJSONRenderer(APITestCase):
+    """
+    ORJSONRenderer must write the same bytes as DRF's JSONRenderer.
+    """
+
+    def assertSameJSON(self, data, accepted_media_type=None, renderer_context=None):
+        expected = JSONRenderer().render(data, accepted_media_type, renderer_context)
+        self.assertEqual(
+            ORJSONRenderer().render(data, accepted_media_type, renderer_context),
+            expected,
+        )
+
+    def test_values(self):
+        now = timezone.now()
+        values = {
+            "none": None,
+            "bool": True,
+            "int": -12,
+            "float": 58848.09,
+            "big_int": 2**70,
+            "string": 'Zoë <a> & "b" \u2028 \u2029 \U0001f600',
+            "decimal": Decimal("12345678.99"),
+            "decimal_zero": Decimal("0.00"),
+            "aware_datetime": now,
+            "utc_datetime": datetime(2022, 5, 1, 12, 30, tzinfo=dt_timezone.utc),
+            "naive_datetime": datetime(2022, 5, 1, 12, 30, 15, 123456),
+            "date": date(2022, 5, 1),
+            "time": time(12, 30, 15, 500),
+            "timedelta": timedelta(days=1, seconds=3),
+            "uuid": uuid.UUID("cc23f040-1970-4ccf-8998-be0ebcf50c1e"),
+            "lazy": gettext_lazy("Name"),
+            "error": ErrorDetail("This field is required.", code="required"),
+            "tuple": (1, "a"),
+            "set": {3},
+            "nested": OrderedDict([("b", [1, {"c": []}]), ("a", {})]),
+            1: "integer key",
+        }
+        for name, value in values.items():
+            with self.subTest(name):
+                self.assertSameJSON(value)
+                self.assertSameJSON({name: value})
+        self.assertSameJSON(values)
+
+    def test_querysets(self):
+        baker.make(Product, _quantity=3)
+        self.assertSameJSON(Product.objects.values("id", "name", "price"))
+
+    def test_indented_output(self):
+        data = {"a": [1, 2], "b": Decimal("1.50")}
+        self.assertSameJSON(data, "application/json; indent=4")
+        self.assertSameJSON(data, None, {"indent": 2})
+
+    def test_unencodable_data_fails_the_same_way(self):
+        for renderer in (JSONRenderer(), ORJSONRenderer()):
+            with self.subTest(renderer):
+                with self.assertRaises(TypeError):
+                    renderer.render({"object": object()})
+                with self.assertRaises(TypeError):
+                    renderer.render({"dataclass": Point(1)})
+
+    def test_none(self):
+        self.assertEqual(ORJSONRenderer().render(None), b"")
+
+    def test_endpoints(self):
+        user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.client.force_authenticate(user)
+        products = baker.make(Product, price=Decimal("9.99"), _quantity=100)
+        for product in products[:20]:
+            order = baker.make(Order, customer=user, total_amount=Decimal("19.98"))
+            baker.make(
+                OrderLine,
+                order=order,
+                product=product,
+                quantity=2,
+                unit_price=product.price,
+            )
+
+        for name in (
+            "products:products-list",
+            "products:orders-list",
+            "customers:customers-list",
+        ):
+            with self.subTest(name):
+                response = self.client.get(reverse(name), {"page_size": 100})
+                self.assertEqual(response.status_code, 200)
+                self.assertIsInstance(response.accepted_renderer, ORJSONRenderer)
+                self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+
+class TestORJSONParser(APITestCase):
+    def parse(self, parser, body, encoding="utf-8"):
+        return parser.parse(
+            io.BytesIO(body), "application/json", {"encoding": encoding}
+        )
+
+    def assertSameParse(self, body, encoding="utf-8"):
+        try:
+            expected = self.parse(JSONParser(), body, encoding)
+        except ParseError as error:
+            with self.assertRaisesMessage(ParseError, str(error.detail)):
+                self.parse(ORJSONParser(), body, encoding)
+        else:
+            self.assertEqual(self.parse(ORJSONParser(), body, encoding), expected)
+
+    def test_documents(self):
+        for body in (
+            b'{"customer": {"username": "jane"}, "products": [{"id": 1}]}',
+            b'[1, 2.5, -0.0, 1e400, true, null, "\\u00e9\\ud83d\\ude00"]',
+            b"123456789012345678901234567890",
+            b"[18446744073709551615, 18446744073709551616]",
+            b"[-9223372036854775808, -9223372036854775809]",
+            b'"\\ud800"',
+            '"Zoë"'.encode(),
+            b'{"a": 1, "a": 2}',
+            b"  {}  ",
+        ):
+            with self.subTest(body):
+                self.assertSameParse(body)
+
+    def test_invalid_documents(self):
+        for body in (b"", b"{", b"[NaN]", b"[Infinity]", b"{'a': 1}", b"\xff"):
+            with self.subTest(body):
+                self.assertSameParse(body)
+
+    def test_other_encodings(self):
+        self.assertSameParse('"Zoë"'.encode("latin-1"), "latin-1")
+        self.assertSameParse('"Zoë"'.encode("utf-16"), "utf-16")
+
+    def test_order_creation(self):
+        user = baker.make(User, username="testuser", email="testuser@test.com")
+        product = baker.make(Product, price=Decimal("1.00"), quantity=5)
+        self.client.force_authenticate(user)
+        response = self.client.post(
+            reverse("products:orders-list"),
+            json.dumps(
+                {
+                    "customer": {"username": "testuser"},
+                    "products": [{"id": product.id, "quantity": 2}],
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["products"], [{"id": product.id, "quantity": 2}])
+
+
+class TestAcceptEncoding(SimpleTestCase):
+    def test_parse(self):
+        self.assertEqual(
+            parse_accept_encoding("gzip, deflate;q=0.5, BR ; q=0.8, zstd;q=x, ,"),
+            {"gzip": 1.0, "deflate": 0.5, "br": 0.8, "zstd": 0.0},
+        )
+
+    def test_negotiate(self):
+        preferred = ("zstd", "br", "gzip")
+        for header, coding in (
+            (None, None),
+            ("", None),
+            ("identity", None),
+            ("deflate", None),
+            ("gzip", "gzip"),
+            ("gzip, br", "br"),
+            ("gzip, br, zstd", "zstd"),
+            ("gzip, br;q=0.5", "gzip"),
+            ("gzip;q=0, br;q=0", None),
+            ("*", "zstd"),
+            ("zstd;q=0, *;q=0.5", "br"),
+        ):
+            with self.subTest(header):
+                with mock.patch.dict(compression.CODECS, ALL_CODECS, clear=True):
+                    self.assertEqual(negotiate(header, preferred), coding)
+
+    def test_missing_libraries(self):
+        with mock.patch.dict(
+            compression.CODECS, {"gzip": compression.GzipCodec()}, clear=True
+        ):
+            self.assertEqual(negotiate("br, zstd, gzip;q=0.1", ("br", "gzip")), "gzip")
+            self.assertIsNone(negotiate("br, zstd", ("zstd", "br", "gzip")))
+
+
+ALL_CODECS = {
+    "gzip": compression.GzipCodec(),
+    "br": compression.BrotliCodec(),
+    "zstd": compression.ZstandardCodec(),
+}
+
+DECOMPRESS = {
+    "gzip": gzip.decompress,
+    "br": lambda data: brotli.decompress(data),
+    "zstd": lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+}
+
+
+@override_settings(COMPRESSION_MIN_SIZE=1024)
+class TestCompressionMiddleware(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.client.force_authenticate(self.user)
+        baker.make(Product, price=Decimal("9.99"), _quantity=100)
+
+    def get(self, name, encoding, **params):
+        return self.client.get(
+            reverse(name), {"page_size": 100, **params}, HTTP_ACCEPT_ENCODING=encoding
+        )
+
+    def test_codings(self):
+        plain = self.get("products:products-list", "identity")
+        self.assertNotIn("Content-Encoding", plain)
+        self.assertEqual(plain["Vary"], "Accept, Accept-Encoding")
+
+        for coding in compression.CODECS:
+            with self.subTest(coding):
+                response = self.get("products:products-list", coding)
+                self.assertEqual(response["Content-Encoding"], coding)
+                self.assertEqual(response["Content-Length"], str(len(response.content)))
+                self.assertLess(len(response.content), len(plain.content))
+                self.assertEqual(DECOMPRESS[coding](response.content), plain.content)
+                self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.get("products:products-list", "gzip", page_size=1)
+        self.assertLess(len(response.content), 1024)
+        self.assertNotIn("Content-Encoding", response)
+
+    @override_settings(COMPRESSION_CONTENT_TYPES=("text/",))
+    def test_other_content_types_are_not_compressed(self):
+        response = self.get("products:products-list", "gzip")
+        self.assertNotIn("Content-Encoding", response)
+
+    @override_settings(COMPRESSION_LEVELS={"gzip": 1, "br": 1, "zstd": 1})
+    def test_levels(self):
+        compressed = self.get("products:products-list", "gzip").content
+        with override_settings(COMPRESSION_LEVELS={"gzip": 9, "br": 9, "zstd": 9}):
+            self.assertLess(
+                len(self.get("products:products-list", "gzip").content),
+                len(compressed),
+            )
+
+    def test_conditional_requests(self):
+        response = self.get("products:products-list", "gzip")
+        self.assertTrue(response["ETag"].startswith('W/"'))
+        not_modified = self.client.get(
+            reverse("products:products-list"),
+            {"page_size": 100},
+            HTTP_ACCEPT_ENCODING="gzip",
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_streaming_export(self):
+        for product in Product.objects.all()[:30]:
+            order = baker.make(Order, customer=self.user, total_amount=product.price)
+            baker.make(
+                OrderLine, order=order, product=product, unit_price=product.price
+            )
+        plain = self.client.get(reverse("customers:customers-export"))
+        body = b"".join(plain.streaming_content)
+
+        for coding in compression.CODECS:
+            with self.subTest(coding):
+                with override_settings(ORDER_EXPORT_CHUNK_SIZE=10):
+                    response = self.client.get(
+                        reverse("customers:customers-export"),
+                        HTTP_ACCEPT_ENCODING=coding,
+                    )
+                self.assertEqual(response["Content-Encoding"], coding)
+                self.assertNotIn("Content-Length", response)
+                chunks = list(response.streaming_content)
+                # A compressed chunk per chunk of orders, and the end of the stream
+                self.assertEqual(len(chunks), 4)
+                self.assertEqual(DECOMPRESS[coding](b"".join(chunks)), body)
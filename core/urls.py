@@ -1,3 +1,4 @@
+from customers.urls import async_urlpatterns as customers_async_urlpatterns
 from django.contrib import admin
 from django.urls import include, path
 from drf_spectacular.views import (
@@ -5,6 +6,7 @@ from drf_spectacular.views import (
     SpectacularRedocView,
     SpectacularSwaggerView,
 )
+from products.urls import async_urlpatterns as products_async_urlpatterns
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -12,6 +14,15 @@ urlpatterns = [
     path("api/customers/", include("customers.urls"), name="customers"),
     # Products
     path("api/products/", include("products.urls"), name="products"),
+    # Async endpoints, meant to be served through core.asgi.application
+    path(
+        "api/async/customers/",
+        include((customers_async_urlpatterns, "customers_async")),
+    ),
+    path(
+        "api/async/products/",
+        include((products_async_urlpatterns, "products_async")),
+    ),
     # API Documentation
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
     path(
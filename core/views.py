@@ -0,0 +1,54 @@
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+
+def sync_to_async_pool(func):
+    """
+    Returns an async version of func, run in the pool of threads
+    used by sync_to_async(thread_sensitive=False).
+
+    Django only closes the database connections of the thread
+    handling the request, so the pool thread's connections are
+    closed before and after func, as request_started and
+    request_finished do, once unusable or older than CONN_MAX_AGE.
+    """
+
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False)
+
+
+def as_async_view(view):
+    """
+    Wraps a sync view, e.g. a DRF viewset action, in an async view.
+
+    Under ASGI, Django runs every sync view in one shared thread,
+    so a slow query in one request holds up all the others.
+    The wrapped view, the ORM queries it makes and the rendering
+    of its response run in the pool of sync_to_async_pool() instead,
+    while the event loop keeps accepting requests.
+
+    Django 4.0 has no async queryset API, so this is the way
+    async code reaches the ORM.
+    """
+
+    def render(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if hasattr(response, "render") and callable(response.render):
+            response.render()
+        return response
+
+    render_in_pool = sync_to_async_pool(render)
+
+    async def async_view(request, *args, **kwargs):
+        return await render_in_pool(request, *args, **kwargs)
+
+    async_view.csrf_exempt = getattr(view, "csrf_exempt", False)
+    async_view.__name__ = getattr(view, "__name__", "async_view")
+    async_view.__doc__ = getattr(view, "__doc__", None)
+    return async_view
@@ -2,6 +2,24 @@ from django.contrib import admin
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
+from .models import CustomerOrderStats
+
 User = get_user_model()
 
 admin.site.register(User, BaseUserAdmin)
+
+
+@admin.register(CustomerOrderStats)
+class CustomerOrderStatsAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "customer",
+        "total_orders",
+        "total_products_ordered",
+        "total_amount_spent",
+        "last_ordered_at",
+    )
+    list_display_links = ("customer",)
+    list_per_page = 10
+    search_fields = ("customer__username", "customer__email")
+    ordering = ("-id",)
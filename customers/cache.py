@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.cache import cache
+
+
+def user_cache_key(user_id):
+    """
+    Cache key of an authenticated user.
+    """
+    return f"auth:user:{user_id}"
+
+
+def get_cached_user(user_model, user_id):
+    """
+    Returns the cached user with the given id, or None.
+
+    The user is rebuilt without a query. The password is never
+    cached, so it is loaded on access like a deferred field.
+    """
+    values = cache.get(user_cache_key(user_id))
+    if values is None:
+        return None
+    return user_model.from_db("default", list(values), list(values.values()))
+
+
+def cache_user(user):
+    values = {
+        field.attname: getattr(user, field.attname)
+        for field in user._meta.concrete_fields
+        if field.attname != "password"
+    }
+    cache.set(user_cache_key(user.pk), values, settings.AUTH_USER_CACHE_TIMEOUT)
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(user_cache_key(user_id))
@@ -0,0 +1,78 @@
+import csv
+import itertools
+
+from django.db.models import prefetch_related_objects
+from rest_framework.utils.encoders import JSONEncoder
+
+CSV_HEADER = (
+    "order_id",
+    "date_ordered",
+    "total_amount_spent_on_order",
+    "product_name",
+    "price",
+    "quantity",
+)
+
+
+class Echo:
+    """
+    File-like object whose write() returns the value written,
+    so csv.writer can produce rows for a streaming response.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_chunks(queryset, chunk_size, *lookups):
+    """
+    Yields the objects of the queryset in lists of up to chunk_size,
+    with the given prefetch lookups run once per list.
+
+    The queryset is read with iterator(), so neither the rows
+    nor the prefetched objects of past chunks are kept around.
+    Django 4.0 ignores prefetch_related() on iterator(),
+    which is why the lookups are applied here per chunk.
+    """
+    objects = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(itertools.islice(objects, chunk_size))
+        if not chunk:
+            return
+        prefetch_related_objects(chunk, *lookups)
+        yield chunk
+
+
+def ndjson_rows(chunks, serializer_class):
+    """
+    Yields one JSON line per object, encoded as the API renders it.
+    """
+    encoder = JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    serializer = serializer_class()
+    for chunk in chunks:
+        yield "".join(
+            encoder.encode(serializer.to_representation(obj)) + "\n" for obj in chunk
+        )
+
+
+def csv_rows(chunks):
+    """
+    Yields the CSV header and one row per order line.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for chunk in chunks:
+        yield "".join(
+            writer.writerow(
+                (
+                    order.order_id,
+                    order.created_at.strftime("%d/%m/%Y"),
+                    order.total_amount,
+                    line.product.name,
+                    line.unit_price,
+                    line.quantity,
+                )
+            )
+            for order in chunk
+            for line in order.lines.all()
+        )
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+THREAD_NAME_PREFIX = "password-hashing"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns the thread pool passwords are hashed in.
+
+    PBKDF2 releases the GIL while it runs, so the pool bounds
+    the number of cores busy hashing at PASSWORD_HASHING_WORKERS,
+    leaving the others to serve requests during a login spike.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASHING_WORKERS,
+                    thread_name_prefix=THREAD_NAME_PREFIX,
+                )
+    return _executor
+
+
+def _in_pool():
+    return threading.current_thread().name.startswith(THREAD_NAME_PREFIX)
+
+
+def _check_password(password, encoded):
+    updates = []
+    return hashers.check_password(password, encoded, updates.append), bool(updates)
+
+
+def _run(func, *args):
+    if _in_pool():
+        return func(*args)
+    return get_executor().submit(func, *args).result()
+
+
+async def _arun(func, *args):
+    return await asyncio.wrap_future(get_executor().submit(func, *args))
+
+
+def make_password(password):
+    """
+    Hashes a password in the hashing pool, waiting for the result.
+    """
+    return _run(hashers.make_password, password)
+
+
+def check_password(password, encoded):
+    """
+    Checks a password against its hash in the hashing pool.
+
+    Returns (is_correct, must_update), where must_update tells
+    whether the hash should be upgraded to the preferred hasher.
+    The upgrade is left to the caller, so that it is saved from
+    the caller's thread and database connection.
+    """
+    return _run(_check_password, password, encoded)
+
+
+async def amake_password(password):
+    """
+    Async make_password(), which frees the event loop while hashing.
+    """
+    return await _arun(hashers.make_password, password)
+
+
+async def acheck_password(password, encoded):
+    """
+    Async check_password(), which frees the event loop while hashing.
+    """
+    return await _arun(_check_password, password, encoded)
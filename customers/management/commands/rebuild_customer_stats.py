@@ -0,0 +1,79 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from products.models import Order
+
+from customers.models import CustomerOrderStats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the customer order stats table from the orders, in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of customers rebuilt per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        last_id = 0
+        rebuilt = 0
+
+        # Walks the customers by primary key so that every chunk
+        # is an index range scan and memory use stays flat
+        while True:
+            ids = list(
+                User.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            self.rebuild_chunk(ids)
+            rebuilt += len(ids)
+            last_id = ids[-1]
+            self.stdout.write(f"Rebuilt order stats of {rebuilt} customers")
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {rebuilt} customers"))
+
+    @transaction.atomic
+    def rebuild_chunk(self, ids):
+        orders = {
+            row["customer_id"]: row
+            for row in Order.objects.filter(customer_id__in=ids)
+            .order_by()
+            .values("customer_id")
+            .annotate(
+                total_orders=Count("id"),
+                total_amount_spent=Sum("total_amount"),
+                last_ordered_at=Max("created_at"),
+            )
+        }
+        products_ordered = dict(
+            Order.products.through.objects.filter(order__customer_id__in=ids)
+            .order_by()
+            .values("order__customer_id")
+            .annotate(total=Count("id"))
+            .values_list("order__customer_id", "total")
+        )
+
+        # Soft deleted rows too, as there is one row per customer
+        CustomerOrderStats.all_objects.filter(customer_id__in=ids).delete()
+        CustomerOrderStats.objects.bulk_create(
+            [
+                CustomerOrderStats(
+                    customer_id=id,
+                    total_orders=orders.get(id, {}).get("total_orders", 0),
+                    total_products_ordered=products_ordered.get(id, 0),
+                    total_amount_spent=orders.get(id, {}).get("total_amount_spent", 0),
+                    last_ordered_at=orders.get(id, {}).get("last_ordered_at"),
+                )
+                for id in ids
+            ]
+        )
@@ -1,8 +1,32 @@
-from core.models import BaseModel
-from django.contrib.auth.models import AbstractUser
-from django.db import models
+from core.models import BaseModel, SoftDeleteManager
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from . import hashing
+from .cache import invalidate_cached_user
+
+
+class SoftDeleteUserManager(SoftDeleteManager, UserManager):
+    """
+    User manager leaving out the users marked as deleted.
+    """
+
+
+class AllUsersManager(UserManager):
+    """
+    User manager returning every user, deleted ones included.
+
+    Users are looked up by their username, e.g. by ModelBackend
+    when logging in, among the users that are not deleted only.
+    """
+
+    def get_by_natural_key(self, username):
+        return self.get(**{self.model.USERNAME_FIELD: username, "is_deleted": False})
+
 
 class CustomUser(BaseModel, AbstractUser):
     """
@@ -19,9 +43,13 @@ class CustomUser(BaseModel, AbstractUser):
         _("Password"), help_text=_("Enter a password."), max_length=100
     )
 
+    objects = SoftDeleteUserManager()
+    all_objects = AllUsersManager()
+
     REQUIRED_FIELDS = ["email", "password"]
 
     class Meta:
+        default_manager_name = "all_objects"
         verbose_name = _("User")
         verbose_name_plural = _("Users")
 
@@ -32,3 +60,139 @@ class CustomUser(BaseModel, AbstractUser):
 
     def __repr__(self) -> str:
         return super().__repr__()
+
+    def set_password(self, raw_password):
+        """
+        Hashes the password in the password hashing pool.
+        """
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """
+        Checks the password in the password hashing pool,
+        upgrading its hash if the preferred hasher changed.
+        """
+        is_correct, must_update = hashing.check_password(raw_password, self.password)
+        if is_correct and must_update:
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=["password"])
+        return is_correct
+
+
+class CustomerOrderStatsQuerySet(models.QuerySet):
+    def record_order(self, order, products_ordered):
+        """
+        Adds an order to its customer's running totals.
+
+        The totals are incremented with F-expressions in a single UPDATE,
+        so this is meant to run inside the transaction creating the order.
+        """
+        self.add_totals(
+            order.customer_id, 1, products_ordered, order.total_amount, order.created_at
+        )
+
+    def record_orders(self, orders):
+        """
+        Adds many orders, given as (order, products_ordered) pairs,
+        with one UPDATE per customer rather than one per order.
+        """
+        totals = {}
+        for order, products_ordered in orders:
+            count, products, amount, last = totals.get(
+                order.customer_id, (0, 0, 0, order.created_at)
+            )
+            totals[order.customer_id] = (
+                count + 1,
+                products + products_ordered,
+                amount + order.total_amount,
+                max(last, order.created_at),
+            )
+        for customer_id, customer_totals in totals.items():
+            self.add_totals(customer_id, *customer_totals)
+
+    def add_totals(
+        self, customer_id, orders, products_ordered, amount_spent, last_ordered_at
+    ):
+        updated = self.filter(customer_id=customer_id).update(
+            total_orders=F("total_orders") + orders,
+            total_products_ordered=F("total_products_ordered") + products_ordered,
+            total_amount_spent=F("total_amount_spent") + amount_spent,
+            last_ordered_at=last_ordered_at,
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            # Customers created before the stats table have no row yet
+            try:
+                with transaction.atomic():
+                    self.create(
+                        customer_id=customer_id,
+                        total_orders=orders,
+                        total_products_ordered=products_ordered,
+                        total_amount_spent=amount_spent,
+                        last_ordered_at=last_ordered_at,
+                    )
+            except IntegrityError:
+                self.add_totals(
+                    customer_id,
+                    orders,
+                    products_ordered,
+                    amount_spent,
+                    last_ordered_at,
+                )
+
+
+class CustomerOrderStats(BaseModel):
+    """
+    Denormalized order totals of a customer.
+
+    The row is updated in the same transaction as every new order,
+    so reading a customer's totals is a single primary key lookup
+    instead of a scan of their orders.
+    It can be rebuilt from the orders with the
+    rebuild_customer_stats management command.
+    """
+
+    customer = models.OneToOneField(
+        CustomUser, on_delete=models.CASCADE, related_name="order_stats"
+    )
+    total_orders = models.PositiveIntegerField(_("Total Orders"), default=0)
+    total_products_ordered = models.PositiveIntegerField(
+        _("Total Products Ordered"), default=0
+    )
+    total_amount_spent = models.DecimalField(
+        _("Total Amount Spent"), max_digits=12, decimal_places=2, default=0
+    )
+    last_ordered_at = models.DateTimeField(_("Last Ordered At"), null=True, blank=True)
+
+    objects = SoftDeleteManager.from_queryset(CustomerOrderStatsQuerySet)()
+    all_objects = CustomerOrderStatsQuerySet.as_manager()
+
+    class Meta:
+        default_manager_name = "all_objects"
+        verbose_name = _("Customer Order Stats")
+        verbose_name_plural = _("Customer Order Stats")
+
+    def __str__(self):
+        return f"{self.customer} - {self.total_orders} orders"
+
+
+@receiver(models.signals.post_save, sender=CustomUser)
+def create_order_stats(sender, instance, created, **kwargs):
+    """
+    Starts every new customer with empty order totals,
+    so recording an order is always a single UPDATE.
+    """
+    if created:
+        CustomerOrderStats.objects.get_or_create(customer=instance)
+
+
+@receiver(models.signals.post_save, sender=CustomUser)
+@receiver(models.signals.post_delete, sender=CustomUser)
+def invalidate_authenticated_user(sender, instance, **kwargs):
+    """
+    Drops the cached user whenever it is saved, e.g. when
+    its password changes or it is deactivated, or deleted.
+    """
+    invalidate_cached_user(instance.pk)
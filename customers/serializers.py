@@ -1,6 +1,9 @@
 from django.contrib.auth import get_user_model
-from django.contrib.auth.hashers import make_password
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import PasswordField
+
+from .hashing import make_password
+from .models import CustomerOrderStats
 
 User = get_user_model()
 
@@ -23,6 +26,15 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ("email", "username", "first_name", "last_name", "password")
 
 
+class LoginSerializer(serializers.Serializer):
+    """
+    Credentials accepted by the async login view.
+    """
+
+    username = serializers.CharField()
+    password = PasswordField()
+
+
 class CustomerSerializer(serializers.ModelSerializer):
     username = serializers.CharField(required=True)
 
@@ -31,6 +43,10 @@ class CustomerSerializer(serializers.ModelSerializer):
         fields = ("username",)
 
     def validate_username(self, value):
+        # The authenticated user is already loaded on the request
+        request = self.context.get("request")
+        if request is not None and request.user.username == value:
+            return value
         try:
             User.objects.get(username=value)
         except User.DoesNotExist:
@@ -38,3 +54,14 @@ class CustomerSerializer(serializers.ModelSerializer):
                 f"There's no user with the username '{value}'. Please register first."
             )
         return value
+
+
+class CustomerOrderStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerOrderStats
+        fields = (
+            "total_orders",
+            "total_products_ordered",
+            "total_amount_spent",
+            "last_ordered_at",
+        )
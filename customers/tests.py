@@ -1,9 +1,23 @@
-from django.contrib.auth import get_user_model
+import csv
+import json
+import threading
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model, hashers
+from django.contrib.auth.signals import user_login_failed
+from django.core.management import call_command
+from django.test import override_settings
 from django.urls import reverse
 from model_bakery import baker
 from products.models import Order, Product
+
+from customers import hashing
+from customers.cache import get_cached_user
+from customers.models import CustomerOrderStats
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
 User = get_user_model()
 
@@ -174,3 +188,328 @@ class TestCustomerOrderHistoryViewset(APITestCase):
         # checks that the next link has no value
         # since this is the last page
         self.assertEqual(next_response_data["next"], None)
+
+
+class TestCustomerOrderHistoryQueries(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.products_set = baker.make(Product, _quantity=5)
+        self.order = baker.make(
+            Order,
+            customer=self.user,
+            products=self.products_set,
+            make_m2m=True,
+            _quantity=100,
+        )
+        self.url = reverse("customers:customers-list")
+
+    def test_history_query_count_is_constant(self):
+        self.client.force_authenticate(self.user)
+
+        # Validators, count, orders with their customer and the products
+        for page_size in (1, 10, 50, 100):
+            with self.assertNumQueries(4):
+                response = self.client.get(self.url, {"page_size": page_size})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.json()["results"]), page_size)
+
+    def test_history_entry_format(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url, {"page_size": 1})
+        entry = response.json()["results"][0]
+
+        self.assertEqual(entry["customer_username"], "testuser")
+        self.assertEqual(entry["customer_email"], "testuser@test.com")
+        self.assertEqual(entry["total_products_ordered"], 5)
+        self.assertEqual(len(entry["products_ordered"]), 5)
+        self.assertEqual(
+            set(entry["products_ordered"][0]), {"name", "price", "quantity"}
+        )
+
+
+class TestOrderHistoryExport(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.products_set = baker.make(Product, _quantity=3)
+        baker.make(
+            Order,
+            customer=self.user,
+            products=self.products_set,
+            make_m2m=True,
+            _quantity=25,
+        )
+        # Orders of other customers are not exported
+        baker.make(Order, products=self.products_set, make_m2m=True)
+        self.url = reverse("customers:customers-export")
+
+    def test_reject_unauthenticated_access(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_ndjson_export_matches_history(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        entries = [json.loads(line) for line in lines]
+        self.assertEqual(len(entries), 25)
+
+        history = self.client.get(
+            reverse("customers:customers-list"), {"page_size": 100}
+        ).json()["results"]
+        self.assertEqual(entries, history)
+
+    def test_csv_export_has_a_row_per_order_line(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url, {"output": "csv"})
+        self.assertEqual(response["Content-Type"], "text/csv")
+
+        content = b"".join(response.streaming_content).decode()
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual(len(rows), 75)
+        self.assertEqual(
+            {row["product_name"] for row in rows},
+            {product.name for product in self.products_set},
+        )
+
+    def test_reject_unknown_output(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url, {"output": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(ORDER_EXPORT_CHUNK_SIZE=10)
+    def test_export_reads_orders_in_chunks(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url)
+
+        # The orders, then the lines of each of the 3 chunks
+        with self.assertNumQueries(4):
+            content = b"".join(response.streaming_content)
+        self.assertEqual(len(content.splitlines()), 25)
+
+
+class TestCustomerOrderStats(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.products = baker.make(
+            Product, price=Decimal("10.00"), quantity=10, _quantity=3
+        )
+        self.url = reverse("customers:customers-summary")
+
+    def place_order(self, products):
+        response = self.client.post(
+            reverse("products:orders-list"),
+            {
+                "customer": {"username": self.user.username},
+                "products": [{"id": p.id, "quantity": 2} for p in products],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_reject_unauthenticated_access(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_summary_tracks_orders(self):
+        self.client.force_authenticate(self.user)
+        self.place_order(self.products)
+        self.place_order(self.products[:1])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        response_data = response.json()
+        self.assertEqual(response_data["total_orders"], 2)
+        self.assertEqual(response_data["total_products_ordered"], 4)
+        self.assertEqual(Decimal(response_data["total_amount_spent"]), Decimal(80))
+        self.assertIsNotNone(response_data["last_ordered_at"])
+
+    def test_rebuild_matches_incremental_stats(self):
+        self.client.force_authenticate(self.user)
+        self.place_order(self.products)
+        self.place_order(self.products[1:])
+        expected = self.client.get(self.url).json()
+
+        CustomerOrderStats.objects.all().delete()
+        call_command("rebuild_customer_stats", chunk_size=1, stdout=StringIO())
+
+        self.assertEqual(self.client.get(self.url).json(), expected)
+
+    def test_rebuild_replaces_soft_deleted_stats(self):
+        self.client.force_authenticate(self.user)
+        self.place_order(self.products)
+        expected = self.client.get(self.url).json()
+
+        CustomerOrderStats.objects.filter(customer=self.user).update(is_deleted=True)
+        call_command("rebuild_customer_stats", stdout=StringIO())
+
+        self.assertEqual(self.client.get(self.url).json(), expected)
+        self.assertEqual(
+            CustomerOrderStats.all_objects.filter(customer=self.user).count(), 1
+        )
+
+
+class TestCachedJWTAuthentication(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.user.set_password("testpassword")
+        self.user.save()
+        response = self.client.post(
+            reverse("customers:login"),
+            {"username": "testuser", "password": "testpassword"},
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}"
+        )
+        self.url = reverse("customers:customers-summary")
+
+    def test_user_is_read_once(self):
+        # The user, then the stats
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cached_user_has_no_password(self):
+        self.client.get(self.url)
+        user = get_cached_user(User, self.user.id)
+        self.assertEqual(user, self.user)
+        self.assertEqual(user.username, "testuser")
+        self.assertIn("password", user.get_deferred_fields())
+
+    def test_user_changes_invalidate_the_cache(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_user_is_rejected(self):
+        self.client.get(self.url)
+        User.all_objects.filter(id=self.user.id).delete()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TestPasswordHashingPool(APITransactionTestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.user.set_password("testpassword")
+        self.user.save()
+
+    def test_passwords_are_hashed_in_the_pool(self):
+        threads = []
+
+        def make_password(password):
+            threads.append(threading.current_thread().name)
+            return original(password)
+
+        original = hashers.make_password
+        with mock.patch.object(hashers, "make_password", make_password):
+            self.user.set_password("newpassword")
+        self.assertTrue(threads[0].startswith(hashing.THREAD_NAME_PREFIX))
+        self.assertTrue(self.user.check_password("newpassword"))
+        self.assertFalse(self.user.check_password("testpassword"))
+
+    def test_outdated_hashes_are_upgraded(self):
+        hasher = hashers.PBKDF2PasswordHasher()
+        self.user.password = hasher.encode("testpassword", hasher.salt(), 1000)
+        self.user.save()
+
+        self.assertTrue(self.user.check_password("testpassword"))
+        self.user.refresh_from_db()
+        self.assertFalse(hasher.must_update(self.user.password))
+
+    def test_async_register(self):
+        url = reverse("customers_async:users-list")
+        data = {
+            "username": "newuser",
+            "email": "newuser@test.com",
+            "password": "newpassword",
+        }
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()["username"], "newuser")
+        self.assertNotIn("password", response.json())
+        self.assertTrue(
+            User.objects.get(username="newuser").check_password("newpassword")
+        )
+
+        # Same validation as the sync endpoint
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            set(response.json()),
+            set(self.client.post(reverse("customers:users-list"), data).json()),
+        )
+
+    def test_async_login(self):
+        url = reverse("customers_async:login")
+        response = self.client.post(
+            url, {"username": "testuser", "password": "testpassword"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.json()), {"access", "refresh"})
+
+        # The token works on the sync endpoints
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}"
+        )
+        response = self.client.get(reverse("customers:customers-summary"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.credentials()
+
+        for data in (
+            {"username": "testuser", "password": "wrongpassword"},
+            {"username": "nobody", "password": "testpassword"},
+        ):
+            response = self.client.post(url, data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(
+                response.json(),
+                self.client.post(reverse("customers:login"), data).json(),
+            )
+
+        response = self.client.post(url, {"username": "testuser"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"password": ["This field is required."]})
+
+    def test_async_login_authenticates_like_the_sync_login(self):
+        url = reverse("customers_async:login")
+        data = {"username": "testuser", "password": "testpassword"}
+        failures = []
+
+        def login_failed(sender, credentials, **kwargs):
+            failures.append(credentials["username"])
+
+        user_login_failed.connect(login_failed)
+        try:
+            response = self.client.post(
+                url, {**data, "password": "wrongpassword"}, format="json"
+            )
+        finally:
+            user_login_failed.disconnect(login_failed)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(failures, ["testuser"])
+
+        # Soft deleted users cannot log in with either login
+        self.user.is_deleted = True
+        self.user.save()
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse("customers:login"), data)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.user.is_deleted = False
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -1,8 +1,14 @@
+from core.views import as_async_view
 from django.urls import path
 from rest_framework.routers import SimpleRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
-from .views import CreateCustomerViewset, CustomerOrderHistoryViewset
+from .views import (
+    CreateCustomerViewset,
+    CustomerOrderHistoryViewset,
+    async_login,
+    async_register,
+)
 
 app_name = "customers"
 
@@ -17,3 +23,15 @@ urlpatterns = [
     path("login/", TokenObtainPairView.as_view(), name="login"),
     path("refresh/", TokenRefreshView.as_view(), name="refresh"),
 ] + router.urls
+
+# Async versions of registration, login and the order history,
+# served through core.asgi.application
+async_urlpatterns = [
+    path("new/", async_register, name="users-list"),
+    path("login/", async_login, name="login"),
+    path(
+        "order-history/",
+        as_async_view(CustomerOrderHistoryViewset.as_view({"get": "list"})),
+        name="customers-list",
+    ),
+]
@@ -1,10 +1,25 @@
+import json
+
+from core.mixins import ConditionalListMixin
 from core.pagination import CustomPagination
-from django.contrib.auth import get_user_model
-from products.models import Order
+from core.views import sync_to_async_pool
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.models import update_last_login
+from django.db.models import Prefetch
+from django.http import JsonResponse, StreamingHttpResponse
+from products.models import Order, OrderLine
 from products.serializers import CustomerOrderHistorySerializer
-from rest_framework import mixins, permissions, viewsets
+from rest_framework import mixins, permissions, serializers, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
 
-from .serializers import UserSerializer
+from . import hashing
+from .exports import csv_rows, iter_chunks, ndjson_rows
+from .models import CustomerOrderStats
+from .serializers import CustomerOrderStatsSerializer, LoginSerializer, UserSerializer
 
 User = get_user_model()
 
@@ -18,7 +33,9 @@ class CreateCustomerViewset(mixins.CreateModelMixin, viewsets.GenericViewSet):
     serializer_class = UserSerializer
 
 
-class CustomerOrderHistoryViewset(mixins.ListModelMixin, viewsets.GenericViewSet):
+class CustomerOrderHistoryViewset(
+    ConditionalListMixin, mixins.ListModelMixin, viewsets.GenericViewSet
+):
     """
     GET: Get a customer's order history
     """
@@ -27,6 +44,9 @@ class CustomerOrderHistoryViewset(mixins.ListModelMixin, viewsets.GenericViewSet
     serializer_class = CustomerOrderHistorySerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = CustomPagination
+    cursor_ordering = "-id"
+    # History entries show their products, so product changes alter them too
+    conditional_fields = ("updated_at", "products__updated_at")
 
     def get_queryset(self):
         """
@@ -34,5 +54,145 @@ class CustomerOrderHistoryViewset(mixins.ListModelMixin, viewsets.GenericViewSet
         """
         user = self.request.user
         if user.is_authenticated:
-            return Order.objects.filter(customer__username=user.username).all()
+            return (
+                Order.objects.filter(customer_id=user.id)
+                .select_related("customer")
+                .prefetch_related(
+                    Prefetch("lines", OrderLine.objects.select_related("product"))
+                )
+            )
         return Order.objects.none()
+
+    @action(detail=False, serializer_class=CustomerOrderStatsSerializer)
+    def summary(self, request):
+        """
+        GET: Get a customer's order totals from the stats table
+        """
+        stats = CustomerOrderStats.objects.filter(customer_id=request.user.id).first()
+        if stats is None:
+            stats = CustomerOrderStats(customer=request.user)
+        return Response(self.get_serializer(stats).data)
+
+    @action(detail=False)
+    def export(self, request):
+        """
+        GET: Stream a customer's full order history as NDJSON,
+        or as CSV with ?output=csv
+        """
+        output = request.query_params.get("output", "ndjson")
+        if output not in ("ndjson", "csv"):
+            raise serializers.ValidationError(
+                {"output": "Must be either 'ndjson' or 'csv'."}
+            )
+
+        queryset = Order.objects.filter(customer_id=request.user.id).select_related(
+            "customer"
+        )
+        chunks = iter_chunks(
+            queryset,
+            settings.ORDER_EXPORT_CHUNK_SIZE,
+            Prefetch("lines", OrderLine.objects.select_related("product")),
+        )
+        if output == "csv":
+            response = StreamingHttpResponse(csv_rows(chunks), content_type="text/csv")
+        else:
+            response = StreamingHttpResponse(
+                ndjson_rows(chunks, CustomerOrderHistorySerializer),
+                content_type="application/x-ndjson",
+            )
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="order-history.{output}"'
+        return response
+
+
+def parse_body(request):
+    """
+    Returns the JSON or form data of a request, or None if it is invalid.
+    """
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError:
+            return None
+    return request.POST
+
+
+def method_not_allowed(request):
+    return JsonResponse(
+        {"detail": f'Method "{request.method}" not allowed.'}, status=405
+    )
+
+
+def issue_tokens(user):
+    refresh = TokenObtainPairSerializer.get_token(user)
+    if api_settings.UPDATE_LAST_LOGIN:
+        update_last_login(None, user)
+    return {"refresh": str(refresh), "access": str(refresh.access_token)}
+
+
+async def async_register(request):
+    """
+    POST: Create a new customer
+
+    Async version of the customer registration, hashing the password
+    in the password hashing pool without holding a thread while it waits.
+    """
+    if request.method != "POST":
+        return method_not_allowed(request)
+    data = parse_body(request)
+    if data is None:
+        return JsonResponse({"detail": "JSON parse error."}, status=400)
+
+    serializer = UserSerializer(data=data)
+    if not await sync_to_async_pool(serializer.is_valid)():
+        return JsonResponse(serializer.errors, status=400)
+
+    validated_data = dict(serializer.validated_data)
+    validated_data["password"] = await hashing.amake_password(
+        validated_data["password"]
+    )
+    serializer.instance = await sync_to_async_pool(User._default_manager.create)(
+        **validated_data
+    )
+    return JsonResponse(serializer.data, status=201)
+
+
+async def async_login(request):
+    """
+    POST: Generate an access and refresh token
+
+    Async version of the login. The credentials are checked by
+    authenticate(), as for the sync login, in a sync_to_async_pool()
+    thread, and the password itself in the password hashing pool.
+    """
+    if request.method != "POST":
+        return method_not_allowed(request)
+    data = parse_body(request)
+    if data is None:
+        return JsonResponse({"detail": "JSON parse error."}, status=400)
+
+    serializer = LoginSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    user = await sync_to_async_pool(authenticate)(
+        request,
+        **{
+            User.USERNAME_FIELD: serializer.validated_data["username"],
+            "password": serializer.validated_data["password"],
+        },
+    )
+    if not api_settings.USER_AUTHENTICATION_RULE(user):
+        return JsonResponse(
+            {"detail": "No active account found with the given credentials"},
+            status=401,
+            headers={"WWW-Authenticate": 'Bearer realm="api"'},
+        )
+
+    tokens = await sync_to_async_pool(issue_tokens)(user)
+    return JsonResponse(tokens)
+
+
+# Token authentication only, as for the DRF views
+async_register.csrf_exempt = True
+async_login.csrf_exempt = True
@@ -1,29 +1,42 @@
 from django.contrib import admin
 
-from .models import Order, Product
+from .models import Order, OrderLine, Product
 
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = (
         "id",
+        "sku",
         "name",
         "price",
         "quantity",
         "out_of_stock",
+        "stock_shards",
         "is_deleted",
     )
     list_display_links = ("name",)
+    # Sharding moves stock around, use the rebalance_stock command for it
+    readonly_fields = ("stock_shards",)
     list_filter = ("created_at", "updated_at", "is_deleted", "out_of_stock")
     list_editable = ("is_deleted",)
     list_per_page = 10
     date_hierarchy = "created_at"
-    search_fields = ("id", "name")
+    search_fields = ("id", "sku", "name")
     ordering = ("-id",)
 
 
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    fields = ("product", "quantity", "unit_price")
+    readonly_fields = ("product", "quantity", "unit_price")
+    extra = 0
+    can_delete = False
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
+    inlines = (OrderLineInline,)
     list_display = (
         "id",
         "order_id",
@@ -0,0 +1,89 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+def _get_version(key):
+    """
+    A missing version starts from the current time so that it never
+    collides with the version of entries cached before an eviction.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_catalog_version():
+    """
+    Returns the current version of the product catalog.
+
+    Every cached product page is stored under the version it was
+    built with, so bumping the version retires all of them at once.
+    """
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+def product_version_key(product_id):
+    return f"catalog:product-version:{product_id}"
+
+
+def product_page_key(request):
+    """
+    Cache key of a product list page.
+
+    The page links are absolute urls, so the key is derived
+    from the full url including the host and the query string.
+    """
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f"catalog:page:{get_catalog_version()}:{url}"
+
+
+def product_detail_key(product_id):
+    """
+    Cache key of a single product, under the version of the product.
+
+    The key is taken before the product is read, so a product read
+    before a change commits is stored under a retired version.
+    """
+    version = _get_version(product_version_key(product_id))
+    return f"catalog:product:{product_id}:{version}"
+
+
+def get_cached(key):
+    return cache.get(key)
+
+
+def set_cached(key, data):
+    cache.set(key, data, settings.CATALOG_CACHE_TIMEOUT)
+
+
+def _invalidate(product_ids, pages):
+    if pages:
+        try:
+            cache.incr(CATALOG_VERSION_KEY)
+        except ValueError:
+            cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+    if product_ids:
+        version = time.time_ns()
+        cache.set_many({product_version_key(id): version for id in product_ids}, None)
+
+
+def invalidate_catalog(product_ids=(), pages=True):
+    """
+    Retires the cached detail of the given products and,
+    unless pages is False, every cached product page.
+
+    The invalidation is repeated once the surrounding transaction
+    commits, so an entry cached from a concurrent read of the
+    uncommitted rows does not outlive the change.
+    """
+    product_ids = list(product_ids)
+    _invalidate(product_ids, pages)
+    transaction.on_commit(lambda: _invalidate(product_ids, pages))
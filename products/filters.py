@@ -0,0 +1,82 @@
+from decimal import Decimal, InvalidOperation
+
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend
+
+from .search import search_products
+
+
+class ProductFilterBackend(BaseFilterBackend):
+    """
+    Filters the product list with the query parameters:
+
+    - search: words the product name must contain, matched as prefixes
+    - min_price / max_price: inclusive price range
+    - in_stock: true for products in stock, false for the others
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if view.action != "list":
+            # Single products are cached by id alone
+            return queryset
+        params = request.query_params
+        errors = {}
+
+        for param, lookup in (("min_price", "price__gte"), ("max_price", "price__lte")):
+            if params.get(param):
+                try:
+                    price = Decimal(params[param])
+                except InvalidOperation:
+                    price = None
+                if price is None or not price.is_finite():
+                    errors[param] = "A valid number is required."
+                else:
+                    queryset = queryset.filter(**{lookup: price})
+
+        in_stock = params.get("in_stock")
+        if in_stock:
+            if in_stock.lower() in ("true", "1"):
+                queryset = queryset.filter(out_of_stock=False)
+            elif in_stock.lower() in ("false", "0"):
+                queryset = queryset.filter(out_of_stock=True)
+            else:
+                errors["in_stock"] = "Must be either 'true' or 'false'."
+
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        if params.get("search"):
+            queryset = search_products(queryset, params["search"][:100])
+        return queryset
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": "search",
+                "required": False,
+                "in": "query",
+                "description": "Words the product name must contain.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": "min_price",
+                "required": False,
+                "in": "query",
+                "description": "Lowest price of the products.",
+                "schema": {"type": "number"},
+            },
+            {
+                "name": "max_price",
+                "required": False,
+                "in": "query",
+                "description": "Highest price of the products.",
+                "schema": {"type": "number"},
+            },
+            {
+                "name": "in_stock",
+                "required": False,
+                "in": "query",
+                "description": "Only products in stock (true) or out of stock (false).",
+                "schema": {"type": "boolean"},
+            },
+        ]
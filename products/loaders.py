@@ -0,0 +1,80 @@
+from django.db import connection
+from django.db.models import Sum
+
+from .models import Product, StockShard
+
+
+class ProductLoader:
+    """
+    Identity map of the products used while handling a request.
+
+    The serializers that validate and create an order all ask
+    the loader for products, so each product is fetched
+    from the database once per request, in a single batch
+    when the ids are known up front.
+    """
+
+    def __init__(self):
+        self._products = {}
+
+    def prime(self, ids):
+        """
+        Loads all the products with the given ids that
+        are not in the map yet with a single query.
+        Ids that do not exist are remembered as None.
+        """
+        missing = [id for id in set(ids) if id not in self._products]
+        if missing:
+            found = Product.objects.in_bulk(missing)
+            for id in missing:
+                self._products[id] = found.get(id)
+            load_sharded_stock(found.values())
+
+    def get(self, id):
+        """
+        Returns the product with the given id, or None if it does not exist.
+        """
+        if id not in self._products:
+            self.prime([id])
+        return self._products[id]
+
+    def lock(self, ids):
+        """
+        Re-reads the products with row locks taken in id order,
+        on databases that support SELECT ... FOR UPDATE.
+        Elsewhere the products already in the map are used as they are.
+        """
+        if connection.features.has_select_for_update:
+            self._products.update(Product.objects.lock_for_order(ids))
+
+
+def get_product_loader(context):
+    """
+    Returns the product loader shared by every serializer
+    handling the request found in the serializer context.
+    """
+    request = context.get("request")
+    if request is None:
+        return context.setdefault("product_loader", ProductLoader())
+    if not hasattr(request, "product_loader"):
+        request.product_loader = ProductLoader()
+    return request.product_loader
+
+
+def load_sharded_stock(products):
+    """
+    Sets the available quantity of the products with sharded stock
+    from the sum of their shards, using one query for all of them.
+    """
+    products = [product for product in products if product.has_sharded_stock]
+    if not products:
+        return
+    totals = dict(
+        StockShard.objects.filter(product__in=products)
+        .order_by()
+        .values("product_id")
+        .annotate(total=Sum("quantity"))
+        .values_list("product_id", "total")
+    )
+    for product in products:
+        product.available_quantity = totals.get(product.id, 0)
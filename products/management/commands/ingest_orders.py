@@ -0,0 +1,257 @@
+import contextlib
+import itertools
+import json
+import time
+import uuid
+from decimal import Decimal
+
+from customers.models import CustomerOrderStats
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from products.loaders import load_sharded_stock
+from products.management import feeds
+from products.models import Order, OrderLine, Product, StockShard
+
+User = get_user_model()
+
+
+class StockChanged(Exception):
+    """
+    Raised when stock changed between validating a batch and applying it.
+    """
+
+
+def read_csv(f):
+    """
+    Yields (line number, order) pairs from a CSV file with one order line
+    per row and the columns order, customer, product_id and quantity.
+    The rows of an order must be consecutive.
+    """
+    rows = feeds.read_csv(f, ("order", "customer", "product_id", "quantity"))
+    for _, group in itertools.groupby(rows, key=lambda item: item[1]["order"]):
+        group = list(group)
+        yield group[0][0], {
+            "customer": group[0][1]["customer"],
+            "products": [
+                {"id": row["product_id"], "quantity": row["quantity"]}
+                for _, row in group
+            ],
+        }
+
+
+def parse_order(data):
+    """
+    Returns (username, {product id: quantity}) for an order in the
+    format of the order API, which JSONL files have one of per line:
+    {"customer": {"username": "..."}, "products": [{"id": 1, "quantity": 2}]}
+    The customer may also be given as a plain username.
+    Raises ValueError with the reason an order is rejected.
+    """
+    if isinstance(data, ValueError):
+        raise data
+    if not isinstance(data, dict):
+        raise ValueError("Not an order")
+    customer = data.get("customer")
+    username = customer.get("username") if isinstance(customer, dict) else customer
+    if not username:
+        raise ValueError("Missing customer")
+
+    lines = data.get("products")
+    if not isinstance(lines, list) or not lines:
+        raise ValueError("Missing products")
+    quantities = {}
+    for line in lines:
+        try:
+            product_id, quantity = int(line["id"]), int(line["quantity"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Invalid product line: {line}")
+        if quantity < 1:
+            raise ValueError(f"Quantity of product {product_id} must be positive")
+        if product_id in quantities:
+            raise ValueError(f"Product {product_id} is repeated")
+        quantities[product_id] = quantity
+    return username, quantities
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams orders from a JSONL or CSV file into the database "
+        "in batches, each validated with set-based queries "
+        "and committed in its own transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to read, '-' for stdin.")
+        parser.add_argument(
+            "--format",
+            choices=("jsonl", "csv"),
+            help="Defaults to the file extension.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of orders validated and committed per transaction.",
+        )
+        parser.add_argument(
+            "--rejects",
+            help="Write rejected orders to this JSONL file instead of stderr.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if feeds.feed_format(path, options["format"]) == "csv":
+            read = read_csv
+        else:
+            read = feeds.read_jsonl
+        batch_size = options["batch_size"]
+
+        self.accepted = 0
+        self.rejected = 0
+        self.rejects = None
+        started = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            source = stack.enter_context(feeds.open_feed(path))
+            if options["rejects"]:
+                self.rejects = stack.enter_context(open(options["rejects"], "w"))
+            for batch in feeds.iter_batches(read(source), batch_size):
+                self.ingest_batch(batch)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"{self.accepted + self.rejected} orders read, "
+                    f"{self.accepted} accepted, {self.rejected} rejected, "
+                    f"{(self.accepted + self.rejected) / elapsed:.0f} orders/s"
+                )
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Done in {elapsed:.1f}s: {self.accepted} orders accepted, "
+                f"{self.rejected} rejected, "
+                f"{self.accepted / elapsed if elapsed else 0:.0f} orders/s"
+            )
+        )
+
+    def reject(self, lineno, reason):
+        self.rejected += 1
+        line = json.dumps({"line": lineno, "reason": reason})
+        if self.rejects:
+            self.rejects.write(line + "\n")
+        else:
+            self.stderr.write(line)
+
+    def ingest_batch(self, batch, attempts=3):
+        """
+        Validates and commits one batch, retrying it from scratch
+        if the stock changed while it was being validated.
+        """
+        for attempt in range(attempts):
+            try:
+                with transaction.atomic():
+                    accepted, rejected = self.apply_batch(batch)
+                break
+            except StockChanged:
+                if attempt == attempts - 1:
+                    raise CommandError("Stock kept changing, giving up on a batch")
+        self.accepted += accepted
+        for lineno, reason in sorted(rejected):
+            self.reject(lineno, reason)
+
+    def apply_batch(self, batch):
+        parsed = []
+        rejected = []
+        for lineno, data in batch:
+            try:
+                parsed.append((lineno, *parse_order(data)))
+            except ValueError as e:
+                rejected.append((lineno, str(e)))
+
+        # One query for the customers and one for the products of the batch
+        customers = dict(
+            User.objects.filter(
+                username__in={username for _, username, _ in parsed}
+            ).values_list("username", "id")
+        )
+        products = Product.objects.lock_for_order(
+            {id for _, _, quantities in parsed for id in quantities}
+        )
+        load_sharded_stock(products.values())
+        stock = {id: product.available_quantity for id, product in products.items()}
+
+        # Accepts the orders in file order against the stock left
+        accepted = []
+        for lineno, username, quantities in parsed:
+            reason = None
+            if username not in customers:
+                reason = f"There's no user with the username '{username}'"
+            for product_id, quantity in quantities.items():
+                if reason:
+                    break
+                product = products.get(product_id)
+                if product is None:
+                    reason = f"Product with the id '{product_id}' does not exist"
+                elif product.is_out_of_stock:
+                    reason = f"Product with the id '{product_id}' is out of stock"
+                elif stock[product_id] < quantity:
+                    reason = (
+                        f"Not enough of product '{product_id}' in stock, "
+                        f"only {stock[product_id]} left"
+                    )
+            if reason:
+                rejected.append((lineno, reason))
+                continue
+            for product_id, quantity in quantities.items():
+                stock[product_id] -= quantity
+            accepted.append((customers[username], quantities))
+
+        if accepted:
+            self.place_orders(accepted, products)
+        return len(accepted), rejected
+
+    def place_orders(self, accepted, products):
+        # One conditional UPDATE for the stock of the whole batch
+        unsharded = {}
+        for _, quantities in accepted:
+            for product_id, quantity in quantities.items():
+                product = products[product_id]
+                if product.has_sharded_stock:
+                    if not StockShard.objects.claim(product, quantity):
+                        raise StockChanged
+                else:
+                    unsharded[product_id] = unsharded.get(product_id, 0) + quantity
+        available = {id: products[id].quantity for id in unsharded}
+        if Product.objects.decrement_stock(unsharded, available) != len(unsharded):
+            raise StockChanged
+
+        orders = Order.objects.bulk_create(
+            [
+                Order(
+                    order_id=uuid.uuid4(),
+                    customer_id=customer_id,
+                    total_amount=sum(
+                        (products[id].price * quantity for id, quantity in q.items()),
+                        Decimal(0),
+                    ),
+                )
+                for customer_id, q in accepted
+            ]
+        )
+        feeds.fill_inserted_ids(Order, orders, "order_id")
+
+        OrderLine.objects.bulk_create(
+            [
+                OrderLine(
+                    order=order,
+                    product_id=product_id,
+                    quantity=quantity,
+                    unit_price=products[product_id].price,
+                )
+                for order, (_, quantities) in zip(orders, accepted)
+                for product_id, quantity in quantities.items()
+            ]
+        )
+        CustomerOrderStats.objects.record_orders(
+            (order, len(quantities)) for order, (_, quantities) in zip(orders, accepted)
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from products.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Deletes the expired idempotency keys of orders, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of keys deleted per statement.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        expired = IdempotencyKey.objects.expired().order_by("id")
+        purged = 0
+
+        # Deleting in batches keeps every statement and its locks short
+        while True:
+            ids = list(expired.values_list("id", flat=True)[:batch_size])
+            if not ids:
+                break
+            IdempotencyKey.objects.filter(id__in=ids).delete()
+            purged += len(ids)
+
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} idempotency keys"))
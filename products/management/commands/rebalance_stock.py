@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.models import MAX_STOCK_SHARDS, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebalances the stock shards of every product with sharded stock. "
+        "Meant to run periodically, e.g. every minute from cron during a sale. "
+        "With --product and --shards, (re)shards the stock of one product instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--product", type=int, help="Id of a single product.")
+        parser.add_argument(
+            "--shards",
+            type=int,
+            help=(
+                "Number of shards to split the product's stock across, "
+                f"0 to unshard, up to {MAX_STOCK_SHARDS}."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.filter(stock_shards__gt=0)
+        if options["product"] is not None:
+            products = Product.objects.filter(id=options["product"])
+            if not products.exists():
+                raise CommandError(f"Product {options['product']} does not exist")
+
+        if options["shards"] is not None:
+            if options["product"] is None:
+                raise CommandError("--shards needs --product")
+            if not 0 <= options["shards"] <= MAX_STOCK_SHARDS:
+                raise CommandError(f"--shards must be between 0 and {MAX_STOCK_SHARDS}")
+            product = products.get()
+            product.shard_stock(options["shards"])
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Split the stock of {product} across {options['shards']} shards"
+                )
+            )
+            return
+
+        rebalanced = 0
+        for product in products.order_by("id").iterator():
+            total = product.rebalance_stock()
+            rebalanced += 1
+            self.stdout.write(f"{product}: {total} in stock")
+        self.stdout.write(self.style.SUCCESS(f"Rebalanced {rebalanced} products"))
@@ -0,0 +1,276 @@
+import random
+import time
+import uuid
+from decimal import Decimal
+
+from customers import hashing
+from customers.models import CustomerOrderStats
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from products.models import Order, OrderLine, Product
+
+User = get_user_model()
+
+# Columns of the rows seed_orders() inserts
+ORDER_FIELDS = (
+    "id",
+    "created_at",
+    "updated_at",
+    "is_deleted",
+    "order_id",
+    "customer",
+    "total_amount",
+)
+ORDER_LINE_FIELDS = (
+    "id",
+    "created_at",
+    "updated_at",
+    "is_deleted",
+    "order",
+    "product",
+    "quantity",
+    "unit_price",
+)
+
+ADJECTIVES = ("red", "blue", "green", "black", "white", "vintage", "classic", "smart")
+MATERIALS = ("cotton", "leather", "steel", "wooden", "glass", "wool", "ceramic")
+NOUNS = ("shirt", "bag", "lamp", "chair", "bottle", "watch", "mug", "jacket", "desk")
+
+
+def product_name(rng):
+    return f"{rng.choice(ADJECTIVES)} {rng.choice(MATERIALS)} {rng.choice(NOUNS)}"
+
+
+def product_price(id):
+    """
+    Price of a seeded product, derived from its id so that
+    order lines can be priced without loading the products.
+    """
+    return Decimal((id * 7919) % 99900 + 100) / 100
+
+
+def next_id(model):
+    return (model.all_objects.aggregate(last=Max("id"))["last"] or 0) + 1
+
+
+def insert_rows(cursor, model, fields, rows):
+    """
+    Inserts rows of values, in the order of fields, into the model's table.
+    """
+    quote = connection.ops.quote_name
+    columns = ", ".join(quote(model._meta.get_field(name).column) for name in fields)
+    placeholders = ", ".join(["%s"] * len(fields))
+    cursor.executemany(
+        f"INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})",
+        rows,
+    )
+
+
+def chunks(start, total, size):
+    """
+    Yields the id ranges of total rows from start, size rows at a time.
+    """
+    for offset in range(0, total, size):
+        yield range(start + offset, start + min(offset + size, total))
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds customers, products and orders with bulk inserts "
+        "for load testing. The same seed gives the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--customers", type=int, default=100_000)
+        parser.add_argument("--products", type=int, default=1_000_000)
+        parser.add_argument("--orders", type=int, default=10_000_000)
+        parser.add_argument(
+            "--max-lines",
+            type=int,
+            default=4,
+            help="Each order has between 1 and this many lines.",
+        )
+        parser.add_argument(
+            "--password",
+            default="benchpassword",
+            help="Password of every seeded customer.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10_000,
+            help="Number of rows inserted per transaction.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["orders"] and not (options["customers"] and options["products"]):
+            raise CommandError("Orders need at least one customer and one product.")
+        if options["max_lines"] < 1:
+            raise CommandError("--max-lines must be at least 1.")
+
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        started = time.perf_counter()
+
+        if connection.vendor == "sqlite" and not connection.in_atomic_block:
+            # Skips the fsync of every commit on this connection only
+            connection.cursor().execute("PRAGMA synchronous = OFF")
+
+        customer_ids = self.seed_customers(options["customers"], options["password"])
+        product_ids = self.seed_products(options["products"])
+        stats = self.seed_orders(
+            options["orders"], customer_ids, product_ids, options["max_lines"]
+        )
+        self.seed_stats(customer_ids, stats)
+
+        # Ids were set explicitly, so sequences must catch up on PostgreSQL
+        sql = connection.ops.sequence_reset_sql(
+            no_style(), [User, Product, Order, OrderLine, CustomerOrderStats]
+        )
+        with connection.cursor() as cursor:
+            for statement in sql:
+                cursor.execute(statement)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Done in {time.perf_counter() - started:.1f}s")
+        )
+
+    def insert(self, model, rows):
+        with transaction.atomic():
+            model.all_objects.bulk_create(rows, batch_size=self.batch_size)
+
+    def seed_customers(self, total, password):
+        """
+        Inserts the customers, who all share one password hash,
+        and returns their id range.
+        """
+        start = next_id(User)
+        password = hashing.make_password(password)
+        for ids in chunks(start, total, self.batch_size):
+            self.insert(
+                User,
+                [
+                    User(
+                        id=id,
+                        username=f"bench{id}",
+                        email=f"bench{id}@example.com",
+                        password=password,
+                    )
+                    for id in ids
+                ],
+            )
+            self.stdout.write(f"Inserted {ids[-1] - start + 1} customers")
+        return range(start, start + total)
+
+    def seed_products(self, total):
+        start = next_id(Product)
+        for ids in chunks(start, total, self.batch_size):
+            self.insert(
+                Product,
+                [
+                    Product(
+                        id=id,
+                        sku=f"BENCH-{id:08d}",
+                        name=f"{product_name(self.rng)} {id}",
+                        price=product_price(id),
+                        # Enough stock for load tests to keep ordering
+                        quantity=1_000_000,
+                    )
+                    for id in ids
+                ],
+            )
+            self.stdout.write(f"Inserted {ids[-1] - start + 1} products")
+        return range(start, start + total)
+
+    def seed_orders(self, total, customer_ids, product_ids, max_lines):
+        """
+        Inserts the orders with their lines, and returns the totals
+        of every customer who ordered, for the order stats.
+
+        Preparing the values of model instances takes most of the time
+        of bulk_create(), so the two largest tables are inserted with
+        executemany() and values adapted for the database by hand.
+        """
+        start = next_id(Order)
+        line_id = next_id(OrderLine)
+        stats = {}
+        rng = self.rng
+        ops = connection.ops
+        now = ops.adapt_datetimefield_value(timezone.now())
+        order_uuid = Order._meta.get_field("order_id")
+        for ids in chunks(start, total, self.batch_size):
+            orders = []
+            lines = []
+            for id in ids:
+                customer_id = rng.choice(customer_ids)
+                total_amount = 0
+                count = rng.randint(1, min(max_lines, len(product_ids)))
+                for product_id in rng.sample(product_ids, count):
+                    quantity = rng.randint(1, 3)
+                    unit_price = product_price(product_id)
+                    total_amount += unit_price * quantity
+                    lines.append(
+                        (
+                            line_id,
+                            now,
+                            now,
+                            False,
+                            id,
+                            product_id,
+                            quantity,
+                            ops.adapt_decimalfield_value(unit_price, 10, 2),
+                        )
+                    )
+                    line_id += 1
+                orders.append(
+                    (
+                        id,
+                        now,
+                        now,
+                        False,
+                        # Derived from the id, which is new on every run
+                        order_uuid.get_db_prep_value(
+                            uuid.uuid5(uuid.NAMESPACE_OID, f"order-{id}"), connection
+                        ),
+                        customer_id,
+                        ops.adapt_decimalfield_value(total_amount, 10, 2),
+                    )
+                )
+                customer = stats.setdefault(customer_id, [0, 0, 0])
+                customer[0] += 1
+                customer[1] += count
+                customer[2] += total_amount
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                insert_rows(cursor, Order, ORDER_FIELDS, orders)
+                insert_rows(cursor, OrderLine, ORDER_LINE_FIELDS, lines)
+            self.stdout.write(f"Inserted {ids[-1] - start + 1} orders")
+        return stats
+
+    def seed_stats(self, customer_ids, stats):
+        """
+        Inserts the order stats of the customers, which the
+        post_save receiver would have created one by one.
+        """
+        # Orders are all created now, as created_at is set on insert
+        now = timezone.now()
+        for ids in chunks(customer_ids.start, len(customer_ids), self.batch_size):
+            rows = []
+            for id in ids:
+                orders, products, amount = stats.get(id, (0, 0, 0))
+                rows.append(
+                    CustomerOrderStats(
+                        customer_id=id,
+                        total_orders=orders,
+                        total_products_ordered=products,
+                        total_amount_spent=amount,
+                        last_ordered_at=now if orders else None,
+                    )
+                )
+            self.insert(CustomerOrderStats, rows)
@@ -0,0 +1,186 @@
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from products.cache import invalidate_catalog
+from products.management import feeds
+from products.models import Product
+
+# Fields the feed sets, compared against the existing rows to find changes
+SYNCED_FIELDS = ("name", "price", "quantity")
+
+
+def read_csv(f):
+    """
+    Yields (line number, row) pairs from a CSV feed
+    with the columns sku, name, price and quantity.
+    """
+    return feeds.read_csv(f, ("sku", *SYNCED_FIELDS))
+
+
+def parse_product(data):
+    """
+    Returns (sku, {field: value}) for a feed row, e.g.
+    {"sku": "...", "name": "...", "price": "1.50", "quantity": 10},
+    or raises ValueError with the reason it is rejected.
+    """
+    if isinstance(data, ValueError):
+        raise data
+    if not isinstance(data, dict):
+        raise ValueError("Not a product")
+
+    sku = str(data.get("sku") or "").strip()
+    if not sku or len(sku) > 64:
+        raise ValueError("The sku must have between 1 and 64 characters")
+    name = str(data.get("name") or "").strip()
+    if not name or len(name) > 255:
+        raise ValueError("The name must have between 1 and 255 characters")
+    try:
+        price = Decimal(str(data.get("price"))).quantize(Decimal("0.01"))
+        quantity = int(data.get("quantity"))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError("Invalid price or quantity")
+    if price < 0 or len(price.as_tuple().digits) > 10:
+        raise ValueError(f"Invalid price {price}")
+    return sku, {"name": name, "price": price, "quantity": quantity}
+
+
+class Command(BaseCommand):
+    help = (
+        "Syncs the product catalog from a CSV or JSONL feed keyed by sku. "
+        "New products are inserted and changed ones updated in bulk, "
+        "one transaction per batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Feed to read, '-' for stdin.")
+        parser.add_argument(
+            "--format",
+            choices=("jsonl", "csv"),
+            help="Defaults to the file extension.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of feed rows diffed and written per transaction.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would change without writing anything.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if feeds.feed_format(path, options["format"]) == "csv":
+            read = read_csv
+        else:
+            read = feeds.read_jsonl
+        batch_size = options["batch_size"]
+        self.dry_run = options["dry_run"]
+
+        self.read = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.rejected = 0
+        self.sharded = 0
+        started = time.perf_counter()
+        with feeds.open_feed(path) as source:
+            for batch in feeds.iter_batches(read(source), batch_size):
+                self.read += len(batch)
+                with transaction.atomic():
+                    self.sync_batch(batch)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"{self.read} rows read, {self.read / elapsed:.0f} rows/s"
+                )
+
+        elapsed = time.perf_counter() - started
+        prefix = "Dry run, would have " if self.dry_run else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{prefix}created {self.created}, updated {self.updated}, "
+                f"left {self.unchanged} unchanged and rejected {self.rejected} "
+                f"products in {elapsed:.1f}s"
+            )
+        )
+        if self.sharded:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"The stock of {self.sharded} products with sharded stock "
+                    f"was left as is, use rebalance_stock to reshard them"
+                )
+            )
+
+    def reject(self, lineno, reason):
+        self.rejected += 1
+        self.stderr.write(json.dumps({"line": lineno, "reason": reason}))
+
+    def sync_batch(self, batch):
+        """
+        Diffs one batch of the feed against the database, writes
+        the differences and retires the cached catalog once for
+        the products of the batch that were created or updated.
+        """
+        feed = {}
+        for lineno, data in batch:
+            try:
+                sku, values = parse_product(data)
+            except ValueError as e:
+                self.reject(lineno, str(e))
+                continue
+            # A sku repeated in the batch takes its last values
+            feed[sku] = values
+
+        # Deleted products keep their sku, they are updated but stay deleted
+        existing = {
+            product.sku: product
+            for product in Product.all_objects.filter(sku__in=feed).only(
+                "id", "sku", "stock_shards", *SYNCED_FIELDS
+            )
+        }
+
+        now = timezone.now()
+        new = []
+        changed = []
+        for sku, values in feed.items():
+            product = existing.get(sku)
+            if product is None:
+                new.append(Product(sku=sku, **values))
+                continue
+            if product.has_sharded_stock and product.quantity != values["quantity"]:
+                # The stock of these lives in their shards
+                self.sharded += 1
+                values = {**values, "quantity": product.quantity}
+            if all(getattr(product, field) == values[field] for field in values):
+                self.unchanged += 1
+                continue
+            for field, value in values.items():
+                setattr(product, field, value)
+            product.updated_at = now
+            changed.append(product)
+
+        self.created += len(new)
+        self.updated += len(changed)
+        if self.dry_run:
+            return
+
+        # bulk_create() and bulk_update() skip the update_out_of_stock
+        # receiver, the flag is set for the whole batch in one UPDATE below
+        Product.objects.bulk_create(new, batch_size=1000)
+        Product.all_objects.bulk_update(
+            changed, [*SYNCED_FIELDS, "updated_at"], batch_size=1000
+        )
+        Product.all_objects.filter(
+            sku__in=feed, quantity__lt=1, out_of_stock=False
+        ).update(out_of_stock=True, updated_at=now)
+
+        feeds.fill_inserted_ids(Product, new, "sku")
+        if new or changed:
+            invalidate_catalog([product.pk for product in [*new, *changed]])
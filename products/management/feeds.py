@@ -0,0 +1,81 @@
+import contextlib
+import csv
+import itertools
+import json
+import sys
+
+from django.core.management.base import CommandError
+
+
+def feed_format(path, file_format=None):
+    """
+    Returns the format of a feed, "csv" or "jsonl",
+    defaulting to the extension of its path.
+    """
+    return file_format or ("csv" if path.endswith(".csv") else "jsonl")
+
+
+@contextlib.contextmanager
+def open_feed(path):
+    """
+    Opens a feed for reading, '-' being stdin, which is left open.
+    """
+    if path == "-":
+        yield sys.stdin
+        return
+    with open(path, newline="") as f:
+        yield f
+
+
+def read_jsonl(f):
+    """
+    Yields (line number, row) pairs from a JSONL feed with one JSON
+    document per line. Lines that are not valid JSON yield a ValueError
+    as their row, so that they are rejected along with the other rows.
+    """
+    for lineno, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            yield lineno, json.loads(line)
+        except ValueError as e:
+            yield lineno, ValueError(f"Invalid JSON: {e}")
+
+
+def read_csv(f, columns):
+    """
+    Yields (line number, row) pairs from a CSV feed with a header,
+    which must name all the given columns.
+    """
+    reader = csv.DictReader(f)
+    missing = set(columns) - set(reader.fieldnames or [])
+    if missing:
+        raise CommandError(f"Missing CSV columns: {', '.join(sorted(missing))}")
+    for row in reader:
+        yield reader.line_num, row
+
+
+def iter_batches(rows, batch_size):
+    """
+    Yields the rows in lists of batch_size, so that only
+    one batch of the feed is held in memory at a time.
+    """
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def fill_inserted_ids(model, objs, field):
+    """
+    Sets the primary key of objects inserted with bulk_create()
+    on backends that cannot return the ids of inserted rows,
+    looking them up by a unique field set before the insert.
+    """
+    missing = {getattr(obj, field): obj for obj in objs if obj.pk is None}
+    if not missing:
+        return
+    ids = model._default_manager.filter(**{f"{field}__in": list(missing)})
+    for value, pk in ids.values_list(field, "pk"):
+        missing[value].pk = pk
@@ -1,14 +1,101 @@
+import hashlib
+import json
+import random
 import uuid
 
-from core.models import BaseModel
+from core.models import BaseModel, SoftDeleteManager
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
+from django.db.models import (
+    Case,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    Q,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Trunc
 from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
+from .cache import invalidate_catalog
+
 User = get_user_model()
 
 
+# Most shards a product's stock can be split across
+MAX_STOCK_SHARDS = 64
+
+
+class ProductQuerySet(models.QuerySet):
+    def lock_for_order(self, ids):
+        """
+        Returns the products with the given ids mapped by id.
+
+        Where the database supports it, the rows are locked
+        with SELECT ... FOR UPDATE in ascending id order.
+        Every order takes its locks in the same order, so two
+        orders sharing products wait on each other instead of
+        deadlocking.
+        """
+        queryset = self.filter(id__in=ids).order_by("id")
+        if connection.features.has_select_for_update:
+            queryset = queryset.select_for_update()
+        return {product.id: product for product in queryset}
+
+    def decrement_stock(self, quantities, available=None):
+        """
+        Decrements the quantity of many products in a single UPDATE.
+
+        `quantities` maps product ids to the quantity ordered.
+        A row only matches when it holds enough stock for its line,
+        so the number of updated rows tells the caller whether
+        every line of the order could be fulfilled.
+
+        The update bypasses save(), hence the post_save receiver,
+        so out_of_stock and updated_at are set in the same statement.
+        `available` maps the product ids to the stock the caller read
+        before the update. Only the cached detail of the products is
+        invalidated, and the cached product pages only when a product
+        sells out, which is assumed when `available` is not given.
+        The quantities on the pages may otherwise lag for up to
+        CATALOG_CACHE_TIMEOUT.
+        Products with sharded stock never match, their stock is
+        claimed from their shards instead.
+        """
+        if not quantities:
+            return 0
+
+        enough_stock = Q()
+        new_quantity = []
+        sold_out = []
+        for product_id, quantity in quantities.items():
+            enough_stock |= Q(id=product_id, quantity__gte=quantity)
+            new_quantity.append(When(id=product_id, then=F("quantity") - quantity))
+            sold_out.append(
+                When(id=product_id, quantity__lte=quantity, then=Value(True))
+            )
+
+        updated = self.filter(enough_stock, stock_shards=0).update(
+            quantity=Case(*new_quantity, default=F("quantity")),
+            out_of_stock=Case(*sold_out, default=F("out_of_stock")),
+            updated_at=timezone.now(),
+        )
+        if updated:
+            sold_out = available is None or any(
+                available[product_id] <= quantity
+                for product_id, quantity in quantities.items()
+            )
+            invalidate_catalog(quantities, pages=sold_out)
+        return updated
+
+
 class Product(BaseModel):
     """
     Model for Products.
@@ -22,6 +109,14 @@ class Product(BaseModel):
     while keeping the quantity in stock.
     """
 
+    sku = models.CharField(
+        _("SKU"),
+        help_text=_("Stock keeping unit the catalog feed identifies the product by."),
+        max_length=64,
+        unique=True,
+        null=True,
+        blank=True,
+    )
     name = models.CharField(
         _("Name"), help_text=_("Enter product name."), max_length=255
     )
@@ -34,6 +129,38 @@ class Product(BaseModel):
     out_of_stock = models.BooleanField(
         _("Out of Stock"), help_text=_("Check if product is in stock"), default=False
     )
+    stock_shards = models.PositiveSmallIntegerField(
+        _("Stock Shards"),
+        help_text=_(
+            "Number of counters the stock is split across. 0 keeps it on the product."
+        ),
+        default=0,
+    )
+
+    objects = SoftDeleteManager.from_queryset(ProductQuerySet)()
+    all_objects = ProductQuerySet.as_manager()
+
+    class Meta(BaseModel.Meta):
+        # Partial indexes over the rows the catalog lists, for price
+        # ranges and the in stock list in id order. Databases without
+        # partial indexes skip them.
+        indexes = [
+            models.Index(
+                fields=["price"],
+                condition=Q(is_deleted=False),
+                name="product_price_idx",
+            ),
+            models.Index(
+                fields=["out_of_stock", "id"],
+                condition=Q(is_deleted=False),
+                name="product_in_stock_idx",
+            ),
+            models.Index(
+                fields=["out_of_stock", "price"],
+                condition=Q(is_deleted=False),
+                name="product_stock_price_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -48,20 +175,196 @@ class Product(BaseModel):
         """
         return self.out_of_stock
 
+    @property
+    def has_sharded_stock(self):
+        return self.stock_shards > 0
+
+    @cached_property
+    def available_quantity(self):
+        """
+        The quantity that can be ordered.
+
+        For sharded stock this is the sum of the shards, since the
+        quantity on the product is only refreshed on rebalancing.
+        """
+        if not self.has_sharded_stock:
+            return self.quantity
+        return self.shards.aggregate(total=Sum("quantity"))["total"] or 0
+
     def insufficient_quantity(self, quantity):
         """
         Checks if the quantity of the product
         is less than the given quantity.
         """
-        return self.quantity < quantity
+        return self.available_quantity < quantity
 
     def order_product(self, quantity):
         """
         Decrements the quantity of a product by the given quantity.
+
+        The check and the decrement happen in one conditional UPDATE,
+        so a stale instance can never take more than what is in stock.
+        Returns True if the quantity was reserved.
+        """
+        if self.has_sharded_stock:
+            self.__dict__.pop("available_quantity", None)
+            return StockShard.objects.claim(self, quantity)
+        reserved = Product.objects.filter(id=self.id).decrement_stock(
+            {self.id: quantity}, {self.id: self.quantity}
+        )
+        if reserved:
+            self.refresh_from_db(fields=["quantity", "out_of_stock", "updated_at"])
+        return bool(reserved)
+
+    @transaction.atomic
+    def shard_stock(self, shards):
+        """
+        Splits the stock of the product across the given number
+        of shards, so that orders for it stop queueing on one row.
+        Passing 0 moves the stock back onto the product.
+
+        The product and its shards are locked while the stock is moved,
+        so no order claims stock that is being moved.
         """
-        if not self.insufficient_quantity(quantity):
-            self.quantity -= quantity
-            self.save()
+        product = Product.all_objects.filter(id=self.id)
+        current = StockShard.objects.filter(product=self).order_by("index")
+        if connection.features.has_select_for_update:
+            product = product.select_for_update()
+            current = current.select_for_update()
+        product = product.get()
+        current = list(current)
+        if product.has_sharded_stock:
+            total = sum(shard.quantity for shard in current)
+        else:
+            total = product.quantity
+
+        self.shards.all().delete()
+        StockShard.objects.bulk_create(
+            [
+                StockShard(product=self, index=index, quantity=quantity)
+                for index, quantity in enumerate(split_stock(total, shards))
+            ]
+        )
+        # Saved on the locked row, so no other field of a stale self is written
+        product.quantity = total
+        product.stock_shards = shards
+        product.save(
+            update_fields=["quantity", "stock_shards", "out_of_stock", "updated_at"]
+        )
+        self.refresh_from_db(
+            fields=["quantity", "stock_shards", "out_of_stock", "updated_at"]
+        )
+        self.__dict__.pop("available_quantity", None)
+
+    @transaction.atomic
+    def rebalance_stock(self):
+        """
+        Spreads the stock evenly across the shards again,
+        so that claims keep finding stock on a random shard,
+        and refreshes the quantity shown on the product.
+        Returns the total stock.
+        """
+        if not self.has_sharded_stock:
+            return self.quantity
+
+        shards = StockShard.objects.filter(product=self).order_by("index")
+        if connection.features.has_select_for_update:
+            shards = shards.select_for_update()
+        shards = list(shards)
+        total = sum(shard.quantity for shard in shards)
+        for shard, quantity in zip(shards, split_stock(total, len(shards))):
+            shard.quantity = quantity
+        StockShard.objects.bulk_update(shards, ["quantity"])
+
+        Product.objects.filter(id=self.id).update(
+            quantity=total,
+            out_of_stock=True if total < 1 else F("out_of_stock"),
+            updated_at=timezone.now(),
+        )
+        invalidate_catalog([self.id])
+        self.refresh_from_db(fields=["quantity", "out_of_stock", "updated_at"])
+        self.__dict__.pop("available_quantity", None)
+        return total
+
+
+def split_stock(total, shards):
+    """
+    Splits a quantity into `shards` parts that differ by at most one.
+    """
+    if shards < 1:
+        return []
+    part, remainder = divmod(total, shards)
+    return [part + 1 if index < remainder else part for index in range(shards)]
+
+
+class StockShardQuerySet(models.QuerySet):
+    def claim(self, product, quantity):
+        """
+        Takes the given quantity from the stock shards of a product.
+
+        Most claims are a single conditional UPDATE on a random shard,
+        so concurrent orders for the same product mostly touch
+        different rows. When no single shard holds enough, the
+        quantity is drained from the shards in index order, each with
+        a conditional UPDATE, and the claim is rolled back if any
+        shard ran short in the meantime. Returns True on success.
+        """
+        shards = self.filter(product_id=product.id)
+        index = random.randrange(product.stock_shards)
+        if shards.filter(index=index, quantity__gte=quantity).update(
+            quantity=F("quantity") - quantity
+        ):
+            return True
+
+        try:
+            with transaction.atomic():
+                remaining = quantity
+                for shard in shards.filter(quantity__gt=0).order_by("index"):
+                    take = min(shard.quantity, remaining)
+                    if not shards.filter(id=shard.id, quantity__gte=take).update(
+                        quantity=F("quantity") - take
+                    ):
+                        raise StockShard.ClaimFailed
+                    remaining -= take
+                    if not remaining:
+                        return True
+                raise StockShard.ClaimFailed
+        except StockShard.ClaimFailed:
+            return False
+
+
+class StockShard(BaseModel):
+    """
+    Model for one of the counters a product's stock is split across.
+
+    Orders claim stock from the shards independently, so during
+    a flash sale they do not all queue on the product's row.
+    """
+
+    class ClaimFailed(Exception):
+        pass
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="shards"
+    )
+    index = models.PositiveSmallIntegerField(_("Index"))
+    quantity = models.IntegerField(_("Quantity"), default=0)
+
+    objects = SoftDeleteManager.from_queryset(StockShardQuerySet)()
+    all_objects = StockShardQuerySet.as_manager()
+
+    class Meta(BaseModel.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "index"], name="unique_product_shard"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.product} #{self.index}"
+
+    def __repr__(self) -> str:
+        return f"<StockShard {self.product} #{self.index}: {self.quantity}>"
 
 
 class Order(BaseModel):
@@ -79,7 +382,9 @@ class Order(BaseModel):
     customer = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="customer_orders"
     )
-    products = models.ManyToManyField("products.Product", related_name="product_orders")
+    products = models.ManyToManyField(
+        "products.Product", through="products.OrderLine", related_name="product_orders"
+    )
     total_amount = models.DecimalField(
         _("Total Amount"),
         help_text=_("Total amount of all products automatically generated."),
@@ -89,6 +394,20 @@ class Order(BaseModel):
         default=0,
     )
 
+    class Meta(BaseModel.Meta):
+        indexes = [
+            # A customer's orders newest first, as the order lists page them
+            models.Index(
+                fields=["customer", "-id"],
+                condition=Q(is_deleted=False),
+                name="order_customer_idx",
+            ),
+            # A customer's orders over a period of time
+            models.Index(
+                fields=["customer", "created_at"], name="order_customer_created_idx"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.customer} - {self.created_at}"
 
@@ -96,16 +415,172 @@ class Order(BaseModel):
         return f"<Order {self.customer} - {self.created_at}>"
 
 
-@receiver(models.signals.post_save, sender=Product)
+class OrderLineQuerySet(models.QuerySet):
+    """
+    Revenue reports computed by the database in one aggregate query each.
+    """
+
+    line_total = ExpressionWrapper(
+        F("quantity") * F("unit_price"),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+    def _revenue(self, *group_by):
+        return (
+            self.order_by()
+            .values(*group_by)
+            .annotate(units=Sum("quantity"), revenue=Sum(self.line_total))
+            .order_by(*group_by)
+        )
+
+    def total_revenue(self):
+        return self.aggregate(revenue=Sum(self.line_total))["revenue"] or 0
+
+    def revenue_by_product(self):
+        return self._revenue("product_id")
+
+    def revenue_by_customer(self):
+        return self._revenue("order__customer_id")
+
+    def revenue_by_period(self, kind="month"):
+        """
+        Groups revenue by the day, week, month or year the orders were placed.
+        """
+        return self.annotate(period=Trunc("order__created_at", kind))._revenue("period")
+
+
+class OrderLine(BaseModel):
+    """
+    Model for a product bought in an order.
+
+    The quantity bought and the unit price at the time of the order
+    are recorded on the line, since the product's own quantity
+    and price change afterwards.
+    """
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="lines")
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="order_lines"
+    )
+    quantity = models.PositiveIntegerField(
+        _("Quantity"), help_text=_("Quantity of the product ordered."), default=1
+    )
+    unit_price = models.DecimalField(
+        _("Unit Price"),
+        help_text=_("Price of the product when it was ordered."),
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+    )
+
+    objects = SoftDeleteManager.from_queryset(OrderLineQuerySet)()
+    all_objects = OrderLineQuerySet.as_manager()
+
+    class Meta(BaseModel.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=["order", "product"], name="unique_order_product"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.order} - {self.product}"
+
+    def __repr__(self) -> str:
+        return f"<OrderLine {self.product} x {self.quantity}>"
+
+    @property
+    def line_total(self):
+        return self.unit_price * self.quantity
+
+
+class IdempotencyKeyQuerySet(models.QuerySet):
+    def expired(self):
+        cutoff = timezone.now() - settings.IDEMPOTENCY_KEY_TTL
+        return self.filter(created_at__lt=cutoff)
+
+
+class IdempotencyKey(BaseModel):
+    """
+    Model for the Idempotency-Key sent with an order.
+
+    The response of the first request is stored with the key,
+    so retries of the same request get that response back
+    instead of placing the order again. A hash of the request
+    body is stored too, to tell retries from other requests
+    reusing the key by mistake.
+    Keys expire after settings.IDEMPOTENCY_KEY_TTL and are
+    removed with the purge_idempotency_keys command.
+    """
+
+    key = models.CharField(_("Key"), max_length=255)
+    customer = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="idempotency_keys"
+    )
+    order = models.ForeignKey(
+        Order,
+        to_field="order_id",
+        on_delete=models.CASCADE,
+        related_name="idempotency_keys",
+        null=True,
+    )
+    request_hash = models.CharField(_("Request Hash"), max_length=64)
+    response_status = models.PositiveSmallIntegerField(_("Response Status"))
+    response_body = models.JSONField(_("Response Body"), encoder=DjangoJSONEncoder)
+
+    objects = SoftDeleteManager.from_queryset(IdempotencyKeyQuerySet)()
+    all_objects = IdempotencyKeyQuerySet.as_manager()
+
+    class Meta(BaseModel.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=["customer", "key"], name="unique_customer_idempotency_key"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.customer} - {self.key}"
+
+    @property
+    def is_expired(self):
+        return self.created_at < timezone.now() - settings.IDEMPOTENCY_KEY_TTL
+
+    @staticmethod
+    def hash_request(data):
+        """
+        Returns the SHA-256 of the parsed request body, written as
+        JSON with sorted keys, so that the same order sent with other
+        whitespace or key order hashes the same. Raises TypeError
+        for data that cannot be written as JSON, e.g. uploaded files.
+        """
+        if hasattr(data, "lists"):
+            data = dict(data.lists())
+        body = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+        return hashlib.sha256(body.encode()).hexdigest()
+
+
+@receiver(models.signals.pre_save, sender=Product)
 def update_out_of_stock(sender, instance, **kwargs):
     """
     Updates the out_of_stock field of the product
     when the quantity is updated.
 
+    Runs before the row is written so the flag is saved
+    in the same statement rather than with a second save().
+
     Useful when you want to send an email to the admin
     to notify that a product is out of stock.
     """
     if not instance.out_of_stock:
         if instance.quantity < 1:
             instance.out_of_stock = True
-            instance.save()
+
+
+@receiver(models.signals.post_save, sender=Product)
+@receiver(models.signals.post_delete, sender=Product)
+def invalidate_cached_product(sender, instance, **kwargs):
+    """
+    Drops the cached catalog pages and the cached product
+    whenever a product is saved, e.g. from the admin, or deleted.
+    """
+    invalidate_catalog([instance.id])
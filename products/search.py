@@ -0,0 +1,126 @@
+import re
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = "products_product_fts"
+
+# Keeps the external content FTS5 table in step with products_product,
+# including rows written with bulk_create(), bulk_update() and update()
+FTS_SETUP = (
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name,
+        content='products_product',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+    AFTER INSERT ON products_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+    AFTER DELETE ON products_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name)
+        VALUES ('delete', old.id, old.name);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+    AFTER UPDATE OF name ON products_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name)
+        VALUES ('delete', old.id, old.name);
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+)
+
+WORD = re.compile(r"\w+")
+
+
+def search_words(query):
+    """
+    Splits a search query into the words matched against product names.
+    """
+    return WORD.findall(query.lower())[:10]
+
+
+class ContainsSearch:
+    """
+    Matches products whose name contains every word of the query.
+
+    Works on every database but scans the names, databases with
+    a full text index get a backend of their own.
+    """
+
+    def setup(self, connection):
+        pass
+
+    def filter(self, queryset, words):
+        condition = Q()
+        for word in words:
+            condition &= Q(name__icontains=word)
+        return queryset.filter(condition)
+
+
+class SQLiteFTSSearch(ContainsSearch):
+    """
+    Matches products with an FTS5 index over their names.
+
+    Every word of the query is matched as a prefix,
+    so partial words typed in a search box find products.
+    """
+
+    def setup(self, connection):
+        tables = connection.introspection.table_names()
+        if "products_product" not in tables:
+            return
+        with connection.cursor() as cursor:
+            for statement in FTS_SETUP:
+                cursor.execute(statement)
+            if FTS_TABLE not in tables:
+                # Index the products written before the table existed
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+                )
+
+    def filter(self, queryset, words):
+        match = " ".join(f'"{word}"*' for word in words)
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,)
+            )
+        )
+
+
+def get_search_backend(connection):
+    """
+    Returns the search backend for the database of the connection.
+    """
+    if connection.vendor == "sqlite":
+        return SQLiteFTSSearch()
+    return ContainsSearch()
+
+
+def search_products(queryset, query):
+    """
+    Filters a product queryset down to the products matching the query.
+    """
+    words = search_words(query)
+    if not words:
+        return queryset
+    backend = get_search_backend(connections[queryset.db])
+    return backend.filter(queryset, words)
+
+
+def setup_search(using="default", **kwargs):
+    """
+    post_migrate receiver creating what the search backend needs.
+    """
+    connection = connections[using]
+    get_search_backend(connection).setup(connection)
@@ -1,13 +1,13 @@
 from decimal import Decimal
 
+from customers.models import CustomerOrderStats
 from customers.serializers import CustomerSerializer
-from django.contrib.auth import get_user_model
 from django.db import transaction
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
-from .models import Order, Product
-
-User = get_user_model()
+from .loaders import get_product_loader
+from .models import Order, OrderLine, Product, StockShard
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -30,9 +30,7 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "price", "quantity")
 
     def validate_id(self, value):
-        try:
-            Product.objects.get(id=value)
-        except Product.DoesNotExist:
+        if get_product_loader(self.context).get(value) is None:
             raise serializers.ValidationError(
                 f"Product with the id '{value}' does not exist"
             )
@@ -46,18 +44,57 @@ class ProductSerializer(serializers.ModelSerializer):
     def validate(self, data):
         product_id = data.get("id")
         quantity = data.get("quantity")
-        product = Product.objects.get(id=product_id)
+        product = get_product_loader(self.context).get(product_id)
         if product.is_out_of_stock:
             raise serializers.ValidationError(
                 f"Product with the id '{product_id}' is out of stock."
             )
         if product.insufficient_quantity(quantity):
             raise serializers.ValidationError(
-                f"Not enough products in stock. Only {product.quantity} left."
+                f"Not enough products in stock. Only {product.available_quantity} left."
             )
         return data
 
 
+# Formats prices exactly as the price fields of the serializers above
+PRICE = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+def format_price(value):
+    """
+    Formats a price read from the database as PRICE does.
+
+    The database returns prices with their two decimal places,
+    in which case str() gives the same string at a fraction of the cost.
+    """
+    coerce_to_string = getattr(
+        PRICE, "coerce_to_string", api_settings.COERCE_DECIMAL_TO_STRING
+    )
+    if coerce_to_string and value.as_tuple().exponent == -2:
+        return str(value)
+    return PRICE.to_representation(value)
+
+
+class ProductReadSerializer(ProductSerializer):
+    """
+    GET: List all products, Get single product with id
+
+    Builds the product straight from a row of `values(*row_fields)`,
+    without going through the fields of the serializer.
+    The JSON is the same as the one of ProductSerializer.
+    """
+
+    row_fields = ("id", "name", "price", "quantity")
+
+    def to_representation(self, row):
+        return {
+            "id": row["id"],
+            "name": row["name"],
+            "price": format_price(row["price"]),
+            "quantity": row["quantity"],
+        }
+
+
 class OrderSerializer(serializers.ModelSerializer):
     products = ProductSerializer(many=True)
     customer = CustomerSerializer()
@@ -66,6 +103,22 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ("order_id", "customer", "products")
 
+    def to_internal_value(self, data):
+        """
+        Loads every product in the order with one query
+        before the nested product serializers validate them.
+        """
+        ids = []
+        products = data.get("products") if hasattr(data, "get") else None
+        if isinstance(products, list):
+            for product in products:
+                try:
+                    ids.append(int(product.get("id")))
+                except (AttributeError, TypeError, ValueError):
+                    continue
+        get_product_loader(self.context).prime(ids)
+        return super().to_internal_value(data)
+
     def validate_products(self, value):
         """
         This validation is essential to prevent the same ids
@@ -81,41 +134,152 @@ class OrderSerializer(serializers.ModelSerializer):
 
     @transaction.atomic
     def create(self, validated_data):
-        authenticated_username = self.context["request"].user.username
+        authenticated_user = self.context["request"].user
         customer = validated_data["customer"]
         products = validated_data["products"]
 
-        if customer.get("username") != authenticated_username:
+        if customer.get("username") != authenticated_user.username:
             raise serializers.ValidationError(
                 "Customer username is not the logged in user. Please login with the customer username."
             )
-        customer = User.objects.get(username=authenticated_username)
+        customer = authenticated_user
 
-        total_amount = Decimal(0.0)
-        product_queryset = []
-        for product in products:
-            product_id = product.get("id")
-            quantity = product.get("quantity")
-            product_obj = Product.objects.get(id=product_id)
+        # Maps product ids to the quantity ordered
+        quantities = {
+            product.get("id"): product.get("quantity") for product in products
+        }
+        product_loader = get_product_loader(self.context)
+        # Sharded products are left unlocked, their shards' conditional
+        # UPDATEs keep the claims consistent without queueing on the product
+        product_loader.lock(
+            [
+                product_id
+                for product_id in quantities
+                if not product_loader.get(product_id).has_sharded_stock
+            ]
+        )
 
-            # Calculates the total amount of the order
-            total_amount += product_obj.price * quantity
+        # Calculates the total amount of the order
+        total_amount = Decimal(0.0)
+        for product_id, quantity in quantities.items():
+            total_amount += product_loader.get(product_id).price * quantity
 
-            # Decrements the quantity of the product
-            product_obj.order_product(quantity)
-            product_queryset.append(product_obj)
+        # Decrements the quantity of every product in one statement,
+        # except for products whose stock is claimed from their shards,
+        # in ascending id order like the product locks
+        unsharded = {}
+        for product_id, quantity in sorted(quantities.items()):
+            product = product_loader.get(product_id)
+            if product.has_sharded_stock:
+                if not StockShard.objects.claim(product, quantity):
+                    raise serializers.ValidationError(
+                        "Not enough products in stock to complete the order."
+                    )
+            else:
+                unsharded[product_id] = quantity
+        available = {
+            product_id: product_loader.get(product_id).quantity
+            for product_id in unsharded
+        }
+        if Product.objects.decrement_stock(unsharded, available) != len(unsharded):
+            raise serializers.ValidationError(
+                "Not enough products in stock to complete the order."
+            )
 
-        # Creates the order
+        # Creates the order and its lines in bulk
         try:
             order = Order.objects.create(customer=customer, total_amount=total_amount)
-            order.products.set(product_queryset)
-            order.save()
+            OrderLine.objects.bulk_create(
+                [
+                    OrderLine(
+                        order=order,
+                        product_id=product_id,
+                        quantity=quantity,
+                        unit_price=product_loader.get(product_id).price,
+                    )
+                    for product_id, quantity in quantities.items()
+                ]
+            )
         except Exception as e:
             raise serializers.ValidationError(f"Error creating order: {e}")
 
+        # Keeps the customer's order totals in step with the order
+        CustomerOrderStats.objects.record_order(order, len(quantities))
+
+        # Lets the client, and retries of the request, find the order
+        validated_data["order_id"] = order.order_id
+
         return validated_data
 
 
+def get_order_products(order_ids):
+    """
+    Returns the products of the orders, mapped by order id,
+    in the order the products of an order are listed.
+    """
+    products = {id: [] for id in order_ids}
+    # Every line, as the orders' many-to-many products include them all
+    lines = (
+        OrderLine.all_objects.filter(order_id__in=order_ids)
+        .order_by("-product_id")
+        .values_list(
+            "order_id",
+            "product_id",
+            "product__name",
+            "product__price",
+            "product__quantity",
+        )
+    )
+    for order_id, id, name, price, quantity in lines:
+        products[order_id].append(
+            {
+                "id": id,
+                "name": name,
+                "price": format_price(price),
+                "quantity": quantity,
+            }
+        )
+    return products
+
+
+class OrderReadListSerializer(serializers.ListSerializer):
+    """
+    Loads the products of every order of the page with one query.
+    """
+
+    def to_representation(self, data):
+        orders = list(data)
+        products = get_order_products([order["id"] for order in orders])
+        return [
+            self.child.build_order(order, products[order["id"]]) for order in orders
+        ]
+
+
+class OrderReadSerializer(OrderSerializer):
+    """
+    GET: List all orders, Get single order with order_id
+
+    Builds the order straight from a row of `values(*row_fields)`
+    and the products of `get_order_products()`.
+    The JSON is the same as the one of OrderSerializer.
+    """
+
+    row_fields = ("id", "order_id", "customer__username")
+
+    class Meta(OrderSerializer.Meta):
+        list_serializer_class = OrderReadListSerializer
+
+    def to_representation(self, row):
+        return self.build_order(row, get_order_products([row["id"]])[row["id"]])
+
+    def build_order(self, row, products):
+        return {
+            "order_id": str(row["order_id"]),
+            "customer": {"username": row["customer__username"]},
+            "products": products,
+        }
+
+
 class CustomerOrderHistorySerializer(serializers.ModelSerializer):
     products = ProductSerializer(many=True)
     customer = CustomerSerializer()
@@ -125,19 +289,28 @@ class CustomerOrderHistorySerializer(serializers.ModelSerializer):
         fields = ("id", "customer", "total_amount", "products")
 
     def to_representation(self, instance):
-        data = super().to_representation(instance)
-        for i in ["customer", "id", "total_amount"]:
-            data.pop(i)
-
-        data["customer_username"] = instance.customer.username
-        if instance.customer.email:
-            data["customer_email"] = instance.customer.email
-        data["total_products_ordered"] = len(data["products"])
+        """
+        Builds the history entry straight from the order.
+
+        The view selects the customer and prefetches the lines
+        with their products, so nothing is queried here.
+        The quantity and price are the ones recorded on the order.
+        """
+        customer = instance.customer
+        lines = instance.lines.all()
+
+        data = {"customer_username": customer.username}
+        if customer.email:
+            data["customer_email"] = customer.email
+        data["total_products_ordered"] = len(lines)
         data["total_amount_spent_on_order"] = instance.total_amount
         data["date_ordered"] = instance.created_at.strftime("%d/%m/%Y")
         data["products_ordered"] = [
-            {"name": p.name, "price": p.price, "quantity": p.quantity}
-            for p in instance.products.all()
+            {
+                "name": line.product.name,
+                "price": line.unit_price,
+                "quantity": line.quantity,
+            }
+            for line in lines
         ]
-        data.pop("products")
         return data
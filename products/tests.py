@@ -1,12 +1,45 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
 from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
+from customers.models import CustomerOrderStats
 from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
 from model_bakery import baker
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import (
+    APIRequestFactory,
+    APITestCase,
+    APITransactionTestCase,
+)
 
-from products.models import Order, Product
+from products.cache import product_detail_key, set_cached
+from products.models import (
+    MAX_STOCK_SHARDS,
+    IdempotencyKey,
+    Order,
+    OrderLine,
+    Product,
+    ProductQuerySet,
+    StockShardQuerySet,
+)
+from products.serializers import (
+    PRICE,
+    OrderSerializer,
+    ProductSerializer,
+    format_price,
+)
 
 User = get_user_model()
 
@@ -219,3 +252,1145 @@ class TestOrderViewset(APITestCase):
         self.assertEqual(
             response_data["order_id"], "cc23f040-1970-4ccf-8998-be0ebcf50c1e"
         )
+
+
+class TestOrderCreation(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.products = baker.make(
+            Product, price=Decimal("2.50"), quantity=5, _quantity=20
+        )
+        self.url = reverse("products:orders-list")
+
+    def order_data(self, products, quantity=1):
+        return {
+            "customer": {"username": self.user.username},
+            "products": [{"id": p.id, "quantity": quantity} for p in products],
+        }
+
+    def test_create_order(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            self.url, self.order_data(self.products[:3], quantity=2), format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        order = Order.objects.get(customer=self.user)
+        self.assertEqual(order.total_amount, Decimal("15.00"))
+        self.assertEqual(order.products.count(), 3)
+        for product in self.products[:3]:
+            product.refresh_from_db()
+            self.assertEqual(product.quantity, 3)
+            self.assertFalse(product.out_of_stock)
+
+    def test_create_order_marks_sold_out_products(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            self.url, self.order_data(self.products[:1], quantity=5), format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        product = Product.objects.get(id=self.products[0].id)
+        self.assertEqual(product.quantity, 0)
+        self.assertTrue(product.out_of_stock)
+
+    def test_create_order_query_count_is_constant(self):
+        self.client.force_authenticate(self.user)
+
+        # Validating and placing an order costs the same number
+        # of queries for one line or twenty
+        for products in (self.products[:1], self.products):
+            with self.assertNumQueries(7):
+                response = self.client.post(
+                    self.url, self.order_data(products), format="json"
+                )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_validation_loads_each_product_once(self):
+        request = APIRequestFactory().post(self.url)
+        request.user = self.user
+        serializer = OrderSerializer(
+            data=self.order_data(self.products), context={"request": request}
+        )
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+
+    def test_reject_unknown_product(self):
+        self.client.force_authenticate(self.user)
+        data = self.order_data(self.products[:2])
+        data["products"].append({"id": 0, "quantity": 1})
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
+
+class TestProductStock(APITestCase):
+    def setUp(self):
+        self.product = baker.make(Product, quantity=5)
+
+    def test_order_product_does_not_oversell_stale_instance(self):
+        stale = Product.objects.get(id=self.product.id)
+
+        self.assertTrue(self.product.order_product(4))
+        self.assertEqual(self.product.quantity, 1)
+
+        # The stale instance still believes there are 5 in stock
+        self.assertFalse(stale.order_product(4))
+        self.assertEqual(Product.objects.get(id=self.product.id).quantity, 1)
+
+    def test_order_product_marks_sold_out_in_same_statement(self):
+        with self.assertNumQueries(2):
+            self.assertTrue(self.product.order_product(5))
+        self.assertEqual(self.product.quantity, 0)
+        self.assertTrue(self.product.out_of_stock)
+
+    def test_save_marks_sold_out_without_second_save(self):
+        self.product.quantity = 0
+        with self.assertNumQueries(1):
+            self.product.save()
+        self.assertTrue(Product.objects.get(id=self.product.id).out_of_stock)
+
+
+class TestOrderViewsetQueries(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.products_set = baker.make(Product, _quantity=5)
+        self.order = baker.make(
+            Order,
+            customer=self.user,
+            products=self.products_set,
+            make_m2m=True,
+            _quantity=100,
+        )
+        self.url = reverse("products:orders-list")
+
+    def test_list_query_count_is_constant(self):
+        self.client.force_authenticate(self.user)
+        for page_size in (1, 10, 100):
+            with self.assertNumQueries(4):
+                response = self.client.get(self.url, {"page_size": page_size})
+            self.assertEqual(len(response.json()["results"]), page_size)
+
+
+class TestReadSerializers(APITestCase):
+    """
+    The list and retrieve actions read rows through the read serializers,
+    which must render the same JSON as the model serializers.
+    """
+
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.client.force_authenticate(self.user)
+        prices = ["0.00", "0.10", "1.50", "12345678.99", "100"]
+        self.products = [
+            baker.make(Product, price=Decimal(price), quantity=index)
+            for index, price in enumerate(prices)
+        ]
+        for products in (self.products[:3], self.products[2:], self.products[4:]):
+            order = baker.make(Order, customer=self.user, total_amount=Decimal("9.90"))
+            OrderLine.objects.bulk_create(
+                OrderLine(order=order, product=product, unit_price=product.price)
+                for product in products
+            )
+        # Deleted products still show in the orders they are part of
+        self.products[3].delete
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_product_list(self):
+        response = self.client.get(
+            reverse("products:products-list"), {"page_size": 100}
+        )
+        expected = ProductSerializer(
+            Product.objects.order_by("id", "name"), many=True
+        ).data
+        self.assertEqual(self.render(response.data["results"]), self.render(expected))
+
+    def test_product_detail(self):
+        for product in self.products[:3]:
+            response = self.client.get(
+                reverse("products:products-detail", args=[product.id])
+            )
+            self.assertEqual(
+                response.content, self.render(ProductSerializer(product).data)
+            )
+
+    def test_order_list(self):
+        for params in ({}, {"pagination": "cursor", "page_size": 2}):
+            with self.subTest(params):
+                response = self.client.get(reverse("products:orders-list"), params)
+                orders = Order.objects.filter(customer=self.user)[
+                    : len(response.data["results"])
+                ]
+                self.assertEqual(
+                    self.render(response.data["results"]),
+                    self.render(OrderSerializer(orders, many=True).data),
+                )
+
+    def test_order_detail(self):
+        for order in Order.objects.all():
+            response = self.client.get(
+                reverse("products:orders-detail", args=[order.order_id])
+            )
+            self.assertEqual(response.content, self.render(OrderSerializer(order).data))
+
+    def test_order_creation_is_unchanged(self):
+        response = self.client.post(
+            reverse("products:orders-list"),
+            {
+                "customer": {"username": "testuser"},
+                "products": [{"id": self.products[1].id, "quantity": 1}],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            response.data["products"], [{"id": self.products[1].id, "quantity": 1}]
+        )
+
+    def test_format_price(self):
+        for value in ["0", "1.5", "2.50", "1E+2", "3.14159"]:
+            with self.subTest(value):
+                self.assertEqual(
+                    format_price(Decimal(value)),
+                    PRICE.to_representation(Decimal(value)),
+                )
+
+
+class TestCursorPagination(APITestCase):
+    def setUp(self):
+        self.products = baker.make(Product, _quantity=16)
+        self.url = reverse("products:products-list")
+
+    def test_cursor_pages(self):
+        response = self.client.get(self.url, {"pagination": "cursor"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response_data = response.json()
+
+        # Cursor pages do not count the whole table
+        self.assertNotIn("count", response_data)
+        self.assertEqual(response_data["previous"], None)
+        self.assertNotEqual(response_data["next"], None)
+        self.assertEqual(
+            [p["id"] for p in response_data["results"]],
+            [p.id for p in self.products[:10]],
+        )
+
+        next_response_data = self.client.get(response_data["next"]).json()
+        self.assertEqual(
+            [p["id"] for p in next_response_data["results"]],
+            [p.id for p in self.products[10:]],
+        )
+        self.assertNotEqual(next_response_data["previous"], None)
+        self.assertEqual(next_response_data["next"], None)
+
+    def test_deep_cursor_page_query_count(self):
+        response_data = self.client.get(
+            self.url, {"pagination": "cursor", "page_size": 1}
+        ).json()
+        for _ in range(10):
+            with self.assertNumQueries(2):
+                response_data = self.client.get(response_data["next"]).json()
+        self.assertEqual(response_data["results"][0]["id"], self.products[10].id)
+
+
+class TestProductCatalogCache(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.products = baker.make(Product, quantity=5, _quantity=3)
+        self.list_url = reverse("products:products-list")
+        self.detail_url = reverse(
+            "products:products-detail", args=[self.products[0].id]
+        )
+
+    def test_cached_reads_skip_the_database(self):
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.list_url).status_code, 200)
+            self.assertEqual(self.client.get(self.detail_url).status_code, 200)
+
+    def test_product_save_invalidates(self):
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+
+        product = self.products[0]
+        product.name = "Renamed"
+        product.save()
+
+        self.assertEqual(self.client.get(self.detail_url).json()["name"], "Renamed")
+        names = [p["name"] for p in self.client.get(self.list_url).json()["results"]]
+        self.assertIn("Renamed", names)
+
+    def test_order_placement_invalidates(self):
+        self.client.get(self.detail_url)
+
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            reverse("products:orders-list"),
+            {
+                "customer": {"username": self.user.username},
+                "products": [{"id": self.products[0].id, "quantity": 2}],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.get(self.detail_url).json()["quantity"], 3)
+
+    def place_order(self, quantity):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            reverse("products:orders-list"),
+            {
+                "customer": {"username": self.user.username},
+                "products": [{"id": self.products[0].id, "quantity": quantity}],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.force_authenticate(None)
+
+    def test_orders_keep_the_pages_until_a_product_sells_out(self):
+        self.client.get(self.list_url)
+        self.place_order(2)
+        with self.assertNumQueries(0):
+            self.client.get(self.list_url)
+
+        self.place_order(3)
+        page = self.client.get(self.list_url).json()["results"]
+        self.assertEqual(
+            [p["quantity"] for p in page if p["id"] == self.products[0].id], [0]
+        )
+
+    def test_detail_read_before_a_change_is_not_kept(self):
+        product = self.products[0]
+        key = product_detail_key(product.id)
+        stale = self.client.get(self.detail_url).json()
+
+        # A read that started before the change stores its result late
+        Product.objects.filter(id=product.id).decrement_stock({product.id: 1})
+        set_cached(key, (stale, {}))
+        self.assertEqual(self.client.get(self.detail_url).json()["quantity"], 4)
+
+
+class TestConditionalGet(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.products = baker.make(Product, quantity=5, _quantity=3)
+        self.order = baker.make(
+            Order, customer=self.user, products=self.products, make_m2m=True
+        )
+        self.list_url = reverse("products:products-list")
+        self.detail_url = reverse(
+            "products:products-detail", args=[self.products[0].id]
+        )
+        self.order_url = reverse("products:orders-detail", args=[self.order.order_id])
+
+    def test_product_detail_not_modified(self):
+        response = self.client.get(self.detail_url)
+        self.assertIn("ETag", response)
+        self.assertIn("Last-Modified", response)
+
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_product_list_changes_etag(self):
+        etag = self.client.get(self.list_url)["ETag"]
+        self.products[1].price = Decimal("1.00")
+        self.products[1].save()
+
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_order_detail_not_modified_skips_serialization(self):
+        self.client.force_authenticate(self.user)
+        etag = self.client.get(self.order_url)["ETag"]
+
+        # Only the aggregate query runs
+        with self.assertNumQueries(1):
+            response = self.client.get(self.order_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # A change to one of the order's products changes the order
+        self.products[0].name = "Renamed"
+        self.products[0].save()
+        response = self.client.get(self.order_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_lists_only_have_an_etag(self):
+        self.client.force_authenticate(self.user)
+        url = reverse("customers:customers-list")
+        response = self.client.get(url)
+        self.assertNotIn("Last-Modified", response)
+
+        # Hard deleting an older order leaves the latest updated_at as it was
+        baker.make(Order, customer=self.user)
+        etag = self.client.get(url)["ETag"]
+        Order.all_objects.filter(id=self.order.id).delete()
+        response = self.client.get(
+            url,
+            HTTP_IF_NONE_MATCH=etag,
+            HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60),
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class TestOrderLines(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.other_user = baker.make(User, username="otheruser", email="o@test.com")
+        self.cheap = baker.make(Product, price=Decimal("2.00"), quantity=50)
+        self.dear = baker.make(Product, price=Decimal("10.00"), quantity=50)
+
+    def place_order(self, user, lines):
+        self.client.force_authenticate(user)
+        response = self.client.post(
+            reverse("products:orders-list"),
+            {
+                "customer": {"username": user.username},
+                "products": [{"id": p.id, "quantity": q} for p, q in lines],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_lines_record_quantity_and_unit_price(self):
+        self.place_order(self.user, [(self.cheap, 3), (self.dear, 1)])
+
+        # Later price changes do not alter the order
+        self.cheap.price = Decimal("5.00")
+        self.cheap.save()
+
+        line = OrderLine.objects.get(product=self.cheap)
+        self.assertEqual(line.quantity, 3)
+        self.assertEqual(line.unit_price, Decimal("2.00"))
+        self.assertEqual(line.line_total, Decimal("6.00"))
+
+        history = self.client.get(reverse("customers:customers-list")).json()
+        products_ordered = history["results"][0]["products_ordered"]
+        self.assertIn(
+            {"name": self.cheap.name, "price": 2.0, "quantity": 3}, products_ordered
+        )
+
+    def test_revenue_aggregates(self):
+        self.place_order(self.user, [(self.cheap, 3), (self.dear, 1)])
+        self.place_order(self.other_user, [(self.dear, 2)])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(OrderLine.objects.total_revenue(), Decimal("36.00"))
+        with self.assertNumQueries(1):
+            by_product = {
+                row["product_id"]: (row["units"], row["revenue"])
+                for row in OrderLine.objects.revenue_by_product()
+            }
+        self.assertEqual(by_product[self.cheap.id], (3, Decimal("6.00")))
+        self.assertEqual(by_product[self.dear.id], (3, Decimal("30.00")))
+
+        by_customer = {
+            row["order__customer_id"]: row["revenue"]
+            for row in OrderLine.objects.revenue_by_customer()
+        }
+        self.assertEqual(by_customer[self.user.id], Decimal("16.00"))
+        self.assertEqual(by_customer[self.other_user.id], Decimal("20.00"))
+
+        by_month = list(OrderLine.objects.revenue_by_period("month"))
+        self.assertEqual(len(by_month), 1)
+        self.assertEqual(by_month[0]["revenue"], Decimal("36.00"))
+
+
+class TestAsyncEndpoints(APITransactionTestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.products = baker.make(Product, quantity=5, _quantity=12)
+        baker.make(Order, customer=self.user, products=self.products, make_m2m=True)
+
+    def test_async_catalog_matches_sync(self):
+        sync_response = self.client.get(reverse("products:products-list"), {"page": 2})
+        async_response = self.client.get(
+            reverse("products_async:products-list"), {"page": 2}
+        )
+        self.assertEqual(async_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(async_response["ETag"], sync_response["ETag"])
+        self.assertEqual(
+            async_response.json()["results"], sync_response.json()["results"]
+        )
+
+        product_id = self.products[0].id
+        sync_response = self.client.get(
+            reverse("products:products-detail", args=[product_id])
+        )
+        async_response = self.client.get(
+            reverse("products_async:products-detail", args=[product_id])
+        )
+        self.assertEqual(async_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(async_response.json(), sync_response.json())
+
+    def test_async_order_history(self):
+        url = reverse("customers_async:customers-list")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.json()["results"],
+            self.client.get(reverse("customers:customers-list")).json()["results"],
+        )
+
+    def test_pool_threads_close_their_connections(self):
+        threads = []
+
+        def close_old_connections():
+            threads.append(threading.current_thread())
+
+        with mock.patch("core.views.close_old_connections", close_old_connections):
+            response = self.client.get(reverse("products_async:products-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Before and after the view, in the thread that ran it
+        self.assertEqual(len(threads), 2)
+        self.assertIs(threads[0], threads[1])
+        self.assertIsNot(threads[0], threading.current_thread())
+
+
+class TestShardedStock(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.product = baker.make(Product, price=Decimal("1.00"), quantity=10)
+        self.product.shard_stock(4)
+
+    def place_order(self, quantity):
+        self.client.force_authenticate(self.user)
+        return self.client.post(
+            reverse("products:orders-list"),
+            {
+                "customer": {"username": self.user.username},
+                "products": [{"id": self.product.id, "quantity": quantity}],
+            },
+            format="json",
+        )
+
+    def shard_quantities(self):
+        return list(
+            self.product.shards.order_by("index").values_list("quantity", flat=True)
+        )
+
+    def test_shard_stock_splits_evenly(self):
+        self.assertEqual(self.shard_quantities(), [3, 3, 2, 2])
+        self.assertEqual(Product.objects.get(id=self.product.id).available_quantity, 10)
+
+    def test_orders_claim_from_shards(self):
+        self.assertEqual(self.place_order(2).status_code, status.HTTP_201_CREATED)
+        # Needs more than any single shard holds
+        self.assertEqual(self.place_order(7).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sum(self.shard_quantities()), 1)
+
+        # Availability is checked against the sum of the shards
+        response = self.place_order(2)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Only 1 left", str(response.json()))
+
+    def test_rebalance(self):
+        self.assertTrue(self.product.order_product(7))
+        call_command("rebalance_stock", stdout=StringIO())
+
+        self.assertEqual(self.shard_quantities(), [1, 1, 1, 0])
+        product = Product.objects.get(id=self.product.id)
+        self.assertEqual(product.quantity, 3)
+        self.assertFalse(product.out_of_stock)
+
+        self.assertTrue(product.order_product(3))
+        self.assertFalse(product.order_product(1))
+        self.assertEqual(product.rebalance_stock(), 0)
+        self.assertTrue(Product.objects.get(id=self.product.id).out_of_stock)
+
+    def test_sharded_products_are_not_locked(self):
+        other = baker.make(Product, price=Decimal("1.00"), quantity=10)
+        with mock.patch.object(
+            connection.features, "has_select_for_update", True
+        ), mock.patch.object(
+            ProductQuerySet, "lock_for_order", autospec=True, return_value={}
+        ) as lock_for_order:
+            self.client.force_authenticate(self.user)
+            response = self.client.post(
+                reverse("products:orders-list"),
+                {
+                    "customer": {"username": self.user.username},
+                    "products": [
+                        {"id": self.product.id, "quantity": 1},
+                        {"id": other.id, "quantity": 1},
+                    ],
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        lock_for_order.assert_called_once_with(mock.ANY, [other.id])
+
+    def test_shards_are_claimed_in_id_order(self):
+        other = baker.make(Product, price=Decimal("1.00"), quantity=10)
+        other.shard_stock(2)
+        with mock.patch.object(
+            StockShardQuerySet,
+            "claim",
+            autospec=True,
+            side_effect=StockShardQuerySet.claim,
+        ) as claim:
+            self.client.force_authenticate(self.user)
+            response = self.client.post(
+                reverse("products:orders-list"),
+                {
+                    "customer": {"username": self.user.username},
+                    "products": [
+                        {"id": other.id, "quantity": 1},
+                        {"id": self.product.id, "quantity": 1},
+                    ],
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [call.args[1].id for call in claim.call_args_list],
+            [self.product.id, other.id],
+        )
+
+    def test_shard_count_is_validated(self):
+        for shards in (-1, MAX_STOCK_SHARDS + 1):
+            with self.subTest(shards), self.assertRaises(CommandError):
+                call_command(
+                    "rebalance_stock",
+                    product=self.product.id,
+                    shards=shards,
+                    stdout=StringIO(),
+                )
+        self.assertEqual(self.shard_quantities(), [3, 3, 2, 2])
+
+    def test_shard_stock_keeps_concurrent_edits(self):
+        stale = Product.objects.get(id=self.product.id)
+        Product.objects.filter(id=self.product.id).update(name="Renamed")
+        stale.shard_stock(2)
+
+        product = Product.objects.get(id=self.product.id)
+        self.assertEqual(product.name, "Renamed")
+        self.assertEqual(product.stock_shards, 2)
+        self.assertEqual(stale.stock_shards, 2)
+        self.assertEqual(self.shard_quantities(), [5, 5])
+
+    def test_unshard(self):
+        self.assertTrue(self.product.order_product(4))
+        self.product.shard_stock(0)
+        product = Product.objects.get(id=self.product.id)
+        self.assertEqual(product.quantity, 6)
+        self.assertFalse(product.shards.exists())
+
+
+class TestIdempotentOrderCreation(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.product = baker.make(Product, price=Decimal("3.00"), quantity=10)
+        self.url = reverse("products:orders-list")
+        self.data = {
+            "customer": {"username": self.user.username},
+            "products": [{"id": self.product.id, "quantity": 2}],
+        }
+        self.client.force_authenticate(self.user)
+
+    def post(self, key):
+        return self.client.post(
+            self.url, self.data, format="json", HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replays_the_first_response(self):
+        response = self.post("retry-1")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn("order_id", response.json())
+
+        with self.assertNumQueries(1):
+            retry = self.post("retry-1")
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json(), response.json())
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(id=self.product.id).quantity, 8)
+        stored = IdempotencyKey.objects.get()
+        self.assertEqual(str(stored.order.order_id), response.json()["order_id"])
+
+    def test_key_reused_with_another_body_is_rejected(self):
+        self.post("reused")
+        self.data["products"][0]["quantity"] = 3
+        response = self.post("reused")
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertIn("Idempotency-Key", response.json())
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(Order.objects.count(), 1)
+
+        # The same body in another key order is still a retry
+        self.data["products"][0]["quantity"] = 2
+        self.data = dict(reversed(self.data.items()))
+        response = self.post("reused")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response["Idempotent-Replayed"], "true")
+
+    def test_key_with_an_uploaded_file_is_rejected(self):
+        response = self.client.post(
+            self.url,
+            {"customer": self.user.username, "file": StringIO("not an order")},
+            format="multipart",
+            HTTP_IDEMPOTENCY_KEY="upload",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Idempotency-Key", response.json())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_different_keys_place_different_orders(self):
+        self.post("key-1")
+        self.post("key-2")
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_failed_request_is_not_stored(self):
+        self.data["products"][0]["quantity"] = 20
+        response = self.post("too-many")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_expired_keys(self):
+        self.post("old")
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+
+        # An expired key places the order again
+        self.post("old")
+        self.assertEqual(Order.objects.count(), 2)
+
+        self.post("new")
+        IdempotencyKey.objects.filter(key="old").update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+        call_command("purge_idempotency_keys", batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            list(IdempotencyKey.objects.values_list("key", flat=True)), ["new"]
+        )
+
+
+def call_feed_command(testcase, name, content, suffix, **options):
+    """
+    Writes content to a temporary file, removed after the test, and runs
+    the named command on it. Returns the command's output and the JSON
+    lines of its errors, i.e. the rows it rejected.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=suffix, delete=False) as f:
+        f.write(content)
+    testcase.addCleanup(os.remove, f.name)
+    stdout, stderr = StringIO(), StringIO()
+    call_command(name, f.name, stdout=stdout, stderr=stderr, **options)
+    return stdout.getvalue(), [
+        json.loads(line) for line in stderr.getvalue().splitlines()
+    ]
+
+
+class TestIngestOrders(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.other_user = baker.make(User, username="otheruser", email="o@test.com")
+        self.apple = baker.make(Product, price=Decimal("1.50"), quantity=10)
+        self.pear = baker.make(Product, price=Decimal("2.00"), quantity=3)
+
+    def ingest(self, content, suffix, **options):
+        return call_feed_command(self, "ingest_orders", content, suffix, **options)
+
+    def test_ingest_jsonl(self):
+        rows = [
+            {
+                "customer": "testuser",
+                "products": [{"id": self.apple.id, "quantity": 4}],
+            },
+            {
+                "customer": {"username": "otheruser"},
+                "products": [
+                    {"id": self.apple.id, "quantity": 1},
+                    {"id": self.pear.id, "quantity": 3},
+                ],
+            },
+            # Only 5 apples are left by now
+            {
+                "customer": "testuser",
+                "products": [{"id": self.apple.id, "quantity": 6}],
+            },
+            {"customer": "nobody", "products": [{"id": self.apple.id, "quantity": 1}]},
+            {"customer": "testuser", "products": [{"id": 0, "quantity": 1}]},
+        ]
+        content = "\n".join(json.dumps(row) for row in rows) + "\n{not json\n"
+        stdout, rejects = self.ingest(content, ".jsonl", batch_size=2)
+
+        self.assertIn("2 orders accepted, 4 rejected", stdout)
+        self.assertEqual([reject["line"] for reject in rejects], [3, 4, 5, 6])
+        self.assertIn("only 5 left", rejects[0]["reason"])
+
+        self.assertEqual(Product.objects.get(id=self.apple.id).quantity, 5)
+        pear = Product.objects.get(id=self.pear.id)
+        self.assertEqual(pear.quantity, 0)
+        self.assertTrue(pear.out_of_stock)
+
+        order = Order.objects.get(customer=self.other_user)
+        self.assertEqual(order.total_amount, Decimal("7.50"))
+        self.assertEqual(order.lines.count(), 2)
+        self.assertEqual(
+            CustomerOrderStats.objects.get(customer=self.other_user).total_orders, 1
+        )
+
+    def test_ingest_csv(self):
+        content = (
+            "order,customer,product_id,quantity\n"
+            f"a,testuser,{self.apple.id},2\n"
+            f"a,testuser,{self.pear.id},1\n"
+            f"b,otheruser,{self.apple.id},1\n"
+            f"c,otheruser,{self.pear.id},5\n"
+        )
+        stdout, rejects = self.ingest(content, ".csv")
+
+        self.assertIn("2 orders accepted, 1 rejected", stdout)
+        self.assertEqual(rejects[0]["line"], 5)
+        self.assertEqual(
+            sorted(
+                OrderLine.objects.filter(order__customer=self.user).values_list(
+                    "quantity", flat=True
+                )
+            ),
+            [1, 2],
+        )
+
+    def test_rejects_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            rejects = os.path.join(directory, "rejects.jsonl")
+            with self.assertRaises(FileNotFoundError):
+                call_command(
+                    "ingest_orders",
+                    os.path.join(directory, "missing.jsonl"),
+                    rejects=rejects,
+                    stdout=StringIO(),
+                )
+            self.assertFalse(os.path.exists(rejects))
+
+            stdout, _ = self.ingest("{not json\n", ".jsonl", rejects=rejects)
+            self.assertIn("0 orders accepted, 1 rejected", stdout)
+            with open(rejects) as f:
+                self.assertEqual(json.loads(f.read())["line"], 1)
+
+    def test_batch_query_count_is_constant(self):
+        products = baker.make(
+            Product, price=Decimal("1.00"), quantity=100, _quantity=10
+        )
+        rows = [
+            {
+                "customer": "testuser",
+                "products": [{"id": p.id, "quantity": 1} for p in products[:size]],
+            }
+            for size in range(1, 11)
+        ]
+        content = "\n".join(json.dumps(row) for row in rows)
+        with self.assertNumQueries(8):
+            self.ingest(content, ".jsonl")
+        self.assertEqual(Order.objects.count(), 10)
+
+
+class TestSyncCatalog(APITestCase):
+    def setUp(self):
+        self.apple = baker.make(
+            Product, sku="APL", name="Apple", price=Decimal("1.50"), quantity=10
+        )
+        self.pear = baker.make(
+            Product, sku="PER", name="Pear", price=Decimal("2.00"), quantity=3
+        )
+
+    def sync(self, content, suffix, **options):
+        return call_feed_command(self, "sync_catalog", content, suffix, **options)
+
+    def test_sync_jsonl(self):
+        rows = [
+            {"sku": "APL", "name": "Apple", "price": "1.50", "quantity": 10},
+            {"sku": "PER", "name": "Pear", "price": "2.25", "quantity": 0},
+            {"sku": "FIG", "name": "Fig", "price": 3, "quantity": 7},
+            {"sku": "BAD", "name": "Bad", "price": "free", "quantity": 1},
+        ]
+        content = "\n".join(json.dumps(row) for row in rows)
+        stdout, rejects = self.sync(content, ".jsonl", batch_size=2)
+
+        self.assertIn(
+            "created 1, updated 1, left 1 unchanged and rejected 1 products", stdout
+        )
+        self.assertEqual(rejects, [{"line": 4, "reason": "Invalid price or quantity"}])
+
+        pear = Product.objects.get(sku="PER")
+        self.assertEqual(pear.price, Decimal("2.25"))
+        # Set in SQL, the receiver does not run for bulk updates
+        self.assertTrue(pear.out_of_stock)
+        fig = Product.objects.get(sku="FIG")
+        self.assertEqual((fig.price, fig.quantity, fig.out_of_stock), (3, 7, False))
+        self.assertEqual(
+            Product.objects.get(id=self.apple.id).updated_at, self.apple.updated_at
+        )
+
+    def test_sync_csv(self):
+        content = "sku,name,price,quantity\nAPL,Green Apple,1.50,10\nKIW,Kiwi,0.80,0\n"
+        self.sync(content, ".csv")
+
+        self.assertEqual(Product.objects.get(id=self.apple.id).name, "Green Apple")
+        self.assertTrue(Product.objects.get(sku="KIW").out_of_stock)
+
+    def test_dry_run_writes_nothing(self):
+        content = json.dumps({"sku": "FIG", "name": "Fig", "price": 3, "quantity": 7})
+        stdout, _ = self.sync(content, ".jsonl", dry_run=True)
+
+        self.assertIn("would have created 1", stdout)
+        self.assertFalse(Product.objects.filter(sku="FIG").exists())
+
+    def test_sync_invalidates_cached_catalog(self):
+        url = reverse("products:products-list")
+        self.client.get(url)
+        content = json.dumps(
+            {"sku": "APL", "name": "Apple", "price": 9, "quantity": 10}
+        )
+        self.sync(content, ".jsonl")
+
+        prices = {p["id"]: p["price"] for p in self.client.get(url).json()["results"]}
+        self.assertEqual(prices[self.apple.id], "9.00")
+
+    def test_sync_invalidates_each_batch(self):
+        rows = [
+            {"sku": "APL", "name": "Apple", "price": 9, "quantity": 10},
+            {"sku": "PER", "name": "Pear", "price": "2.00", "quantity": 3},
+            {"sku": "FIG", "name": "Fig", "price": 3, "quantity": 7},
+        ]
+        content = "\n".join(json.dumps(row) for row in rows)
+        with mock.patch(
+            "products.management.commands.sync_catalog.invalidate_catalog"
+        ) as invalidate_catalog:
+            self.sync(content, ".jsonl", batch_size=1)
+
+        fig = Product.objects.get(sku="FIG")
+        self.assertEqual(
+            [call.args for call in invalidate_catalog.call_args_list],
+            [([self.apple.id],), ([fig.id],)],
+        )
+
+    def test_batch_query_count_is_constant(self):
+        rows = [
+            {"sku": f"SKU{i}", "name": f"Product {i}", "price": 1, "quantity": i}
+            for i in range(100)
+        ]
+        content = "\n".join(json.dumps(row) for row in rows)
+        # Savepoint, diff, insert, out_of_stock update, release
+        with self.assertNumQueries(5):
+            self.sync(content, ".jsonl", batch_size=500)
+        self.assertEqual(Product.objects.filter(out_of_stock=True).count(), 1)
+
+
+class TestSeedBenchmark(APITestCase):
+    def seed(self, **options):
+        options = {
+            "customers": 5,
+            "products": 20,
+            "orders": 50,
+            "batch_size": 8,
+            **options,
+        }
+        call_command("seed_benchmark", stdout=StringIO(), **options)
+
+    def test_seed(self):
+        existing = baker.make(Product, sku="APL")
+        self.seed()
+
+        self.assertEqual(User.objects.filter(username__startswith="bench").count(), 5)
+        self.assertEqual(Product.objects.count(), 21)
+        self.assertEqual(Order.objects.count(), 50)
+        self.assertEqual(Product.objects.filter(id__lte=existing.id).count(), 1)
+
+        customer = User.objects.filter(username__startswith="bench").first()
+        self.assertTrue(customer.check_password("benchpassword"))
+
+        for order in Order.objects.prefetch_related("lines"):
+            lines = order.lines.all()
+            self.assertTrue(1 <= len(lines) <= 4)
+            self.assertEqual(order.total_amount, sum(line.line_total for line in lines))
+            for line in lines:
+                self.assertEqual(line.unit_price, line.product.price)
+
+    def test_stats_match_a_rebuild(self):
+        self.seed()
+        seeded = sorted(
+            CustomerOrderStats.objects.values_list(
+                "customer_id",
+                "total_orders",
+                "total_products_ordered",
+                "total_amount_spent",
+            )
+        )
+        self.assertEqual(len(seeded), 5)
+        self.assertEqual(sum(row[1] for row in seeded), 50)
+
+        call_command("rebuild_customer_stats", stdout=StringIO())
+        rebuilt = sorted(
+            CustomerOrderStats.objects.values_list(
+                "customer_id",
+                "total_orders",
+                "total_products_ordered",
+                "total_amount_spent",
+            )
+        )
+        self.assertEqual(seeded, rebuilt)
+
+    def seeded_lines(self):
+        """
+        Returns the seeded order lines without the ids that
+        usernames and product names end with.
+        """
+        return [
+            (username.rstrip("0123456789"), name.rsplit(" ", 1)[0], quantity)
+            for username, name, quantity in OrderLine.objects.order_by(
+                "id"
+            ).values_list("order__customer__username", "product__name", "quantity")
+        ]
+
+    def test_same_seed_gives_the_same_data(self):
+        self.seed()
+        first = self.seeded_lines()
+        Order.all_objects.all().delete()
+        Product.all_objects.all().delete()
+        User.all_objects.all().delete()
+
+        # Ids carry on from the deleted rows
+        self.seed()
+        self.assertEqual(self.seeded_lines(), first)
+
+        self.seed(seed=1)
+        self.assertNotEqual(self.seeded_lines()[-50:], first[-50:])
+
+    def test_seeded_products_are_searchable(self):
+        self.seed(orders=0)
+        name = Product.objects.first().name
+        response = self.client.get(reverse("products:products-list"), {"search": name})
+        self.assertEqual(
+            [product["name"] for product in response.json()["results"]], [name]
+        )
+
+
+class TestProductSearch(APITestCase):
+    def setUp(self):
+        self.url = reverse("products:products-list")
+        self.green = baker.make(
+            Product, name="Green Apple", price=Decimal("1.50"), quantity=10
+        )
+        self.red = baker.make(Product, name="Red Apple", price=Decimal("2.50"))
+        self.pear = baker.make(
+            Product, name="Pear", price=Decimal("3.00"), out_of_stock=True
+        )
+
+    def get_ids(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [product["id"] for product in response.json()["results"]]
+
+    def test_search_matches_words_as_prefixes(self):
+        self.assertEqual(self.get_ids({"search": "app"}), [self.green.id, self.red.id])
+        self.assertEqual(self.get_ids({"search": "gre APP"}), [self.green.id])
+        self.assertEqual(self.get_ids({"search": "plum"}), [])
+        # Punctuation is not passed on to the search syntax
+        self.assertEqual(self.get_ids({"search": 'pe"ar*'}), [])
+        self.assertEqual(self.get_ids({"search": '"pear"'}), [self.pear.id])
+
+    def test_search_follows_product_changes(self):
+        Product.objects.filter(id=self.pear.id).update(name="Plum")
+        baker.make(Product, name="Pearl Onion")
+        self.assertEqual(self.get_ids({"search": "plu"}), [self.pear.id])
+        self.assertEqual(len(self.get_ids({"search": "pear"})), 1)
+
+    def test_price_and_stock_filters(self):
+        self.assertEqual(
+            self.get_ids({"min_price": "2", "max_price": "3"}),
+            [self.red.id, self.pear.id],
+        )
+        self.assertEqual(
+            self.get_ids({"in_stock": "true"}), [self.green.id, self.red.id]
+        )
+        self.assertEqual(self.get_ids({"in_stock": "false"}), [self.pear.id])
+        self.assertEqual(
+            self.get_ids({"search": "apple", "max_price": "2", "in_stock": "true"}),
+            [self.green.id],
+        )
+
+    def test_reject_invalid_filters(self):
+        response = self.client.get(
+            self.url, {"min_price": "cheap", "max_price": "nan", "in_stock": "maybe"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.json()), {"min_price", "max_price", "in_stock"})
+
+    def test_filters_do_not_apply_to_single_products(self):
+        url = reverse("products:products-detail", args=[self.pear.id])
+        response = self.client.get(url, {"in_stock": "true"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TestSoftDelete(APITestCase):
+    def setUp(self):
+        self.user = baker.make(User, username="testuser", email="testuser@test.com")
+        self.product = baker.make(Product, price=Decimal("1.00"), quantity=10)
+        self.deleted_product = baker.make(Product, quantity=10, is_deleted=True)
+        self.order = baker.make(
+            Order, customer=self.user, products=[self.product], make_m2m=True
+        )
+        self.deleted_order = baker.make(
+            Order,
+            customer=self.user,
+            products=[self.deleted_product],
+            make_m2m=True,
+            is_deleted=True,
+        )
+
+    def test_managers(self):
+        self.assertEqual(list(Product.objects.all()), [self.product])
+        self.assertEqual(Product.all_objects.count(), 2)
+        self.assertIs(Product._default_manager, Product.all_objects)
+        self.assertIs(User._default_manager, User.all_objects)
+        # Relations still reach deleted rows
+        self.assertEqual(
+            list(self.deleted_order.products.all()), [self.deleted_product]
+        )
+
+    def test_deleted_products_are_not_listed_or_ordered(self):
+        response = self.client.get(reverse("products:products-list"))
+        self.assertEqual(
+            [product["id"] for product in response.json()["results"]],
+            [self.product.id],
+        )
+        response = self.client.get(
+            reverse("products:products-detail", args=[self.deleted_product.id])
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            reverse("products:orders-list"),
+            {
+                "customer": {"username": "testuser"},
+                "products": [{"id": self.deleted_product.id, "quantity": 1}],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_deleted_orders_are_not_listed(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse("products:orders-list"))
+        self.assertEqual(
+            [order["order_id"] for order in response.json()["results"]],
+            [str(self.order.order_id)],
+        )
+        response = self.client.get(
+            reverse("products:orders-detail", args=[self.deleted_order.order_id])
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
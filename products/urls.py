@@ -1,3 +1,5 @@
+from core.views import as_async_view
+from django.urls import path
 from rest_framework.routers import SimpleRouter
 
 from .views import OrderViewset, ProductViewsets
@@ -10,3 +12,17 @@ router.register("", ProductViewsets, basename="products")
 
 
 urlpatterns = router.urls
+
+# Async versions of the catalog, served through core.asgi.application
+async_urlpatterns = [
+    path(
+        "",
+        as_async_view(ProductViewsets.as_view({"get": "list"})),
+        name="products-list",
+    ),
+    path(
+        "<str:pk>/",
+        as_async_view(ProductViewsets.as_view({"get": "retrieve"})),
+        name="products-detail",
+    ),
+]
@@ -1,26 +1,94 @@
+from core.mixins import ConditionalGetMixin, ReadSerializerMixin
 from core.pagination import CustomPagination
-from rest_framework import mixins, permissions, viewsets
+from django.db import IntegrityError, transaction
+from rest_framework import mixins, permissions, serializers, status, viewsets
+from rest_framework.response import Response
 
-from .models import Order, Product
-from .serializers import OrderSerializer, ProductSerializer
+from .cache import get_cached, product_detail_key, product_page_key, set_cached
+from .filters import ProductFilterBackend
+from .models import IdempotencyKey, Order, Product
+from .serializers import (
+    OrderReadSerializer,
+    OrderSerializer,
+    ProductReadSerializer,
+    ProductSerializer,
+)
 
 
 class ProductViewsets(
-    mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+    ReadSerializerMixin,
+    ConditionalGetMixin,
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
 ):
     """
     GET: List all products, Get single product with id
 
     Customers and guests can view product list and single products
+    The list can be searched by name and filtered by price and stock
     """
 
     queryset = Product.objects.all().order_by("id", "name")
     serializer_class = ProductSerializer
+    read_serializer_class = ProductReadSerializer
     pagination_class = CustomPagination
+    filter_backends = [ProductFilterBackend]
     permissions_classes = [permissions.IsAuthenticatedOrReadOnly]
+    cursor_ordering = "id"
+
+    def list(self, request, *args, **kwargs):
+        """
+        Serves product pages and their validators from the catalog cache.
+        """
+        key = product_page_key(request)
+        cached = get_cached(key)
+        if cached is None:
+            validators = self.get_list_validators(
+                self.filter_queryset(self.get_queryset())
+            )
+        else:
+            data, validators = cached
+
+        not_modified = self.get_not_modified_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        if cached is None:
+            data = mixins.ListModelMixin.list(self, request, *args, **kwargs).data
+            set_cached(key, (data, validators))
+        return self.set_validators(Response(data), validators)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Serves single products and their validators from the catalog cache.
+        """
+        product_id = kwargs[self.lookup_field]
+        key = product_detail_key(product_id)
+        cached = get_cached(key)
+        if cached is None:
+            validators = self.get_object_validators()
+        else:
+            data, validators = cached
+
+        not_modified = self.get_not_modified_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        if cached is None:
+            data = mixins.RetrieveModelMixin.retrieve(
+                self, request, *args, **kwargs
+            ).data
+            # Only stored under the product id, which invalidation knows
+            # about, and under the version taken before the product was read
+            if str(data["id"]) == str(product_id):
+                set_cached(key, (data, validators))
+        return self.set_validators(Response(data), validators)
 
 
 class OrderViewset(
+    ReadSerializerMixin,
+    ConditionalGetMixin,
     mixins.CreateModelMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
@@ -37,15 +105,97 @@ class OrderViewset(
 
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    read_serializer_class = OrderReadSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = CustomPagination
+    cursor_ordering = "-id"
     lookup_field = "order_id"
+    # Orders show their products, so product changes alter them too
+    conditional_fields = ("updated_at", "products__updated_at")
 
     def get_queryset(self):
         """
         Return objects for each authenticated user
         """
         user = self.request.user
-        if user.is_authenticated:
-            return Order.objects.filter(customer__username=user.username).all()
-        return Order.objects.none()
+        if not user.is_authenticated:
+            return Order.objects.none()
+        queryset = Order.objects.filter(customer_id=user.id)
+        if self.action in self.read_actions:
+            # Read as rows, the read serializer loads the products
+            return queryset
+        return queryset.select_related("customer").prefetch_related("products")
+
+    def create(self, request, *args, **kwargs):
+        """
+        Places an order, once per Idempotency-Key.
+
+        A request repeating a key gets the stored response of the
+        first one, without validation or stock updates running again.
+        Reusing a key with a different body is rejected with a 422.
+        The key is stored in the transaction placing the order, so
+        of two concurrent requests with the same key only one commits.
+        """
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return super().create(request, *args, **kwargs)
+        if not key or len(key) > 255:
+            raise serializers.ValidationError(
+                {"Idempotency-Key": "Must be between 1 and 255 characters."}
+            )
+
+        try:
+            request_hash = IdempotencyKey.hash_request(request.data)
+        except TypeError:
+            # e.g. uploaded files, which an order never has
+            raise serializers.ValidationError(
+                {"Idempotency-Key": "Cannot be used with this request body."}
+            )
+        stored = self.get_idempotency_key(key)
+        if stored is not None:
+            return self.replay(stored, request_hash)
+
+        try:
+            with transaction.atomic():
+                response = super().create(request, *args, **kwargs)
+                IdempotencyKey.objects.create(
+                    key=key,
+                    customer=request.user,
+                    order_id=response.data.get("order_id"),
+                    request_hash=request_hash,
+                    response_status=response.status_code,
+                    response_body=response.data,
+                )
+        except IntegrityError:
+            # A concurrent request with the same key placed the order
+            stored = self.get_idempotency_key(key)
+            if stored is None:
+                raise
+            return self.replay(stored, request_hash)
+        return response
+
+    def get_idempotency_key(self, key):
+        """
+        Returns the stored key of the customer, dropping it if it expired.
+        """
+        keys = IdempotencyKey.objects.filter(customer_id=self.request.user.id, key=key)
+        stored = keys.first()
+        if stored is not None and stored.is_expired:
+            # Hard delete, so that the key can be stored again
+            keys.delete()
+            return None
+        return stored
+
+    def replay(self, stored, request_hash):
+        if stored.request_hash != request_hash:
+            return Response(
+                {
+                    "Idempotency-Key": "Already used for a request with a different body."
+                },
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        return Response(
+            stored.response_body,
+            status=stored.response_status,
+            headers={"Idempotent-Replayed": "true"},
+        )